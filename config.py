@@ -9,13 +9,39 @@ import os
 ARCHITECTURES = ['avx_512f', 'avx2', 'avx', 'sse2']
 GMX_BINARY_DIRECTORY_SUFFIX = ['AVX_512', 'AVX2_256', 'AVX_256', 'SSE2']
 
+PRECISIONS = ['single', 'double']
+
 ENGINE_OPTIONS = {
     'simd': ARCHITECTURES,
-    'rdtscp': ['on', 'off']
+    'rdtscp': ['on', 'off'],
+    'precision': PRECISIONS
 }
 
 SIMD_MAPPER = dict(zip(ENGINE_OPTIONS['simd'], GMX_BINARY_DIRECTORY_SUFFIX))
 
+# cpu flags (as listed in /proc/cpuinfo) required to execute each engine
+SIMD_CPU_FLAGS = {
+    'avx_512f': 'avx512f',
+    'avx2': 'avx2',
+    'avx': 'avx',
+    'sse2': 'sse2'
+}
+RDTSCP_CPU_FLAG = 'rdtscp'
+
+
+# How GROMACS engines are linked. static engines are self-contained gmx binaries,
+# only the dependencies that must stay shared (e.g. mpi) are loaded at runtime
+LINK_OPTIONS = ['shared', 'static']
+DEFAULT_LINK = 'shared'
+
+# Memory allocators that can be preloaded for the GROMACS engines. glibc means no preloading
+ALLOCATORS = ['glibc', 'jemalloc', 'tcmalloc', 'mimalloc']
+DEFAULT_ALLOCATOR = 'glibc'
+ALLOCATOR_VERSIONS = {
+    'jemalloc': '5.2.1',
+    'tcmalloc': '2.8',
+    'mimalloc': '1.6.7'
+}
 
 # Minimum Software Version
 
@@ -46,3 +72,91 @@ LIBRARY_SUFFIX_FORMAT = '{mpi}{double}{rdtscp}'
 
 
 WRAPPER_SUFFIX_FORMAT = '{mpi}{double}'
+
+# Memory allocator installation. The wrapper preloads the allocator named by
+# GMX_ALLOCATOR for the dispatched engine, GMX_ALLOCATOR=glibc disables it
+ALLOCATOR_DIRECTORY = '/usr/local/allocator'
+ALLOCATOR_LIBRARIES = {
+    'jemalloc': 'libjemalloc.so.2',
+    'tcmalloc': 'libtcmalloc_minimal.so.4',
+    'mimalloc': 'libmimalloc.so'
+}
+ALLOCATOR_VARIABLE = 'GMX_ALLOCATOR'
+
+# Node-local scratch staging of mdrun's inputs and outputs (wrapper).
+# Enabled by setting GMX_STAGE_DIR to a node-local directory, e.g. /tmp or $TMPDIR
+STAGE_DIRECTORY_VARIABLE = 'GMX_STAGE_DIR'
+STAGE_SYNC_INTERVAL_VARIABLE = 'GMX_STAGE_SYNC_INTERVAL'
+DEFAULT_STAGE_SYNC_INTERVAL = 300
+STAGE_READY_TIMEOUT = 600
+# environment variables giving the rank within the node (Open MPI, MPICH/Intel MPI, MVAPICH2, Slurm)
+LOCAL_RANK_VARIABLES = ['OMPI_COMM_WORLD_LOCAL_RANK', 'MPI_LOCALRANKID', 'MV2_COMM_WORLD_LOCAL_RANK', 'SLURM_LOCALID']
+# environment variables giving the scheduler's job id (Slurm, PBS, LSF, SGE)
+JOB_ID_VARIABLES = ['SLURM_JOB_ID', 'PBS_JOBID', 'LSB_JOBID', 'JOB_ID']
+# environment variables identifying one launch within a job, shared by all its ranks
+# (Slurm step, PMIx namespace, Open MPI job)
+LAUNCH_ID_VARIABLES = ['SLURM_STEP_ID', 'PMIX_NAMESPACE', 'OMPI_MCA_ess_base_jobid', 'OMPI_MCA_orte_ess_jobid']
+# mdrun options naming input files, staged even when given as absolute path
+MDRUN_INPUT_OPTIONS = ['-s', '-cpi', '-table', '-tablep', '-tableb', '-rerun', '-ei', '-mp', '-mn', '-membed']
+# mdrun options naming output files, staged when relative and already existing (appending)
+MDRUN_OUTPUT_OPTIONS = ['-o', '-x', '-cpo', '-c', '-e', '-g', '-dhdl', '-field', '-tpi', '-tpid', '-eo',
+                        '-px', '-pf', '-ro', '-ra', '-rs', '-rt', '-mtx', '-if', '-swap', '-awh']
+MDRUN_DEFAULT_INPUTS = {'-s': 'topol.tpr'}
+# default names of mdrun's outputs, staged when restarting from a checkpoint (without -deffnm)
+MDRUN_DEFAULT_OUTPUTS = {'-o': 'traj.trr', '-x': 'traj_comp.xtc', '-cpo': 'state.cpt', '-c': 'confout.gro',
+                         '-e': 'ener.edr', '-g': 'md.log', '-dhdl': 'dhdl.xvg', '-field': 'field.xvg',
+                         '-tpi': 'tpi.xvg', '-tpid': 'tpidist.xvg', '-eo': 'edsam.xvg', '-px': 'pullx.xvg',
+                         '-pf': 'pullf.xvg', '-ro': 'rotation.xvg', '-ra': 'rotangles.log', '-rs': 'rotslabs.log',
+                         '-rt': 'rottorque.log', '-mtx': 'nm.mtx', '-if': 'imdforces.xvg', '-swap': 'swapions.xvg',
+                         '-awh': 'awhinit.xvg'}
+# default checkpoint read by a bare -cpi (<deffnm>.cpt with -deffnm)
+MDRUN_DEFAULT_CHECKPOINT = 'state.cpt'
+# outputs replacing existing files of the working directory are backed up as #name.N#,
+# as GROMACS does. GMX_MAXBACKUP=-1 overwrites them, GMX_MAXBACKUP=0 refuses to
+MAXBACKUP_VARIABLE = 'GMX_MAXBACKUP'
+DEFAULT_MAXBACKUP = 99
+
+# Run input (.tpr) files, read by the chooser for mdrun -s
+# Version of the GROMACS engines in the image, set in the final image
+GMX_VERSION_VARIABLE = 'GMX_VERSION'
+# newest tpr file version each GROMACS release can read
+GMX_TPX_VERSIONS = {
+    '2018': 112,
+    '2019': 116,
+    '2020': 119,
+    '2021': 122,
+    '2022': 127
+}
+# oldest tpr file version still read by GROMACS
+TPX_MIN_VERSION = 58
+# without -nt/-ntomp or OMP_NUM_THREADS, small systems get one thread per this many atoms
+TPR_ATOMS_PER_THREAD = 500
+
+# Engine manifest: engines of the image, their binaries and required cpu flags.
+# Installed as a file and as an image label, so that schedulers can read it without starting the image
+ENGINE_MANIFEST_FILE = os.path.join(GMX_INSTALLATION_DIRECTORY, 'engines.json')
+ENGINE_MANIFEST_LABEL = 'gromacs.engines'
+
+# Regression test reports, one json file per engine
+GMX_REGTEST_DIRECTORY = os.path.join(GMX_INSTALLATION_DIRECTORY, 'regtest')
+
+# Build instrumentation: every stage logs its timestamp markers to its own file,
+# that are collected into a single json file in the final image
+BUILD_TIMINGS_LOG_DIRECTORY = '/var/tmp/timings'
+BUILD_TIMINGS_FILE = os.path.join(GMX_INSTALLATION_DIRECTORY, 'build-timings.json')
+
+# Configuration related to FFTW wisdom (fftw sub-command)
+# System wisdom files, read by applications calling fftw_import_system_wisdom() (double) or fftwf_import_system_wisdom() (single)
+FFTW_WISDOM_DIRECTORY = '/etc/fftw'
+FFTW_WISDOM_FILES = {
+    'single': 'wisdomf',
+    'double': 'wisdom'
+}
+FFTW_WISDOM_TOOLS = {
+    'single': 'fftwf-wisdom',
+    'double': 'fftw-wisdom'
+}
+# 3-D real-to-complex transforms: out-of-place/in-place, forward/backward
+FFTW_WISDOM_PROBLEMS = ['rof', 'rob', 'rif', 'rib']
+DEFAULT_FFTW_WISDOM_SIZES = ['32x32x32', '48x48x48', '52x52x52', '64x64x64', '96x96x96', '128x128x128']
+DEFAULT_FFTW_WISDOM_THREADS = [1]
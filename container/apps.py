@@ -3,15 +3,78 @@ Author :
     * Muhammed Ahad <ahad3112@yahoo.com, maaahad@gmail.com>
 '''
 
+import os
+import collections
+
 import hpccm
 
 
 import config
+from container.graph import get_stage_copies
+from container.timings import get_marker, instrument
+
+
+def parse_engines(*, args):
+    '''
+    Parsing engines' value. Engines without precision key follow the --double option.
+    Identical engines are listed once, keeping the order given by the user
+    '''
+    engines = []
+    for engine in args.engines:
+        engine_args = map(lambda x: x.strip(), engine.split(':'))
+        engine_args_dict = {'precision': 'double' if args.double else 'single'}
+        for engine_arg in engine_args:
+            key, value = map(lambda x: x.strip(), engine_arg.split('='))
+
+            # Check engine argument and value
+            check_engine_argument(key=key, value=value)
+
+            engine_args_dict[key] = config.SIMD_MAPPER[value] if key == 'simd' else value
+
+        if engine_args_dict not in engines:
+            engines.append(engine_args_dict)
+
+    return engines
+
+
+def check_engine_argument(*, key, value):
+    '''
+    Check whether a value is missing in engines option
+    '''
+    if not key in config.ENGINE_OPTIONS.keys():
+        raise KeyError('{key} not valid engine key. Available keys are {keys}'.format(
+            key=key,
+            keys=list(config.ENGINE_OPTIONS.keys()))
+        )
+    else:
+        if not value in config.ENGINE_OPTIONS[key]:
+            raise ValueError('{value} is not valid value for key "{key}". Available values are : {values}'.format(
+                value=value, key=key, values=config.ENGINE_OPTIONS[key])
+            )
+
+
+def get_bin_libs_suffix(engine, *, building_blocks):
+    '''
+    Set gmx binaries and library suffix based on mpi enabled/disabled,
+    the engine's precision and
+    rdtscp enabled/disabled
+    '''
+    return config.BINARY_SUFFIX_FORMAT.format(mpi=config.GMX_ENGINE_SUFFIX_OPTIONS['mpi'] if building_blocks.get('mpi', None) is not None else '',
+                                              double=config.GMX_ENGINE_SUFFIX_OPTIONS['double'] if engine['precision'] == 'double' else '',
+                                              rdtscp=config.GMX_ENGINE_SUFFIX_OPTIONS['rdtscp'] if engine['rdtscp'].lower() == 'on' else '')
+
+
+def get_regtest_stage_name(engine, *, building_blocks):
+    '''
+    Name of the stage running the regression tests of the engine
+    '''
+    return 'regtest.' + (engine['simd'] + get_bin_libs_suffix(engine, building_blocks=building_blocks)).lower()
 
 
 class Gromacs:
     '''
-    This class is responsible to build and install GROMACS with and withou regression test
+    This class is responsible to build and install GROMACS with and withou regression test.
+    Regression tests run in a separate stage per engine, so that they can run in parallel
     '''
 
     _os_packages = ['build-essential',
@@ -29,7 +92,7 @@ class Gromacs:
                 -D CMAKE_C_COMPILER=$c_compiler$ \
                 -D CMAKE_CXX_COMPILER=$cxx_compiler$ \
                 -D GMX_OPENMP=ON \
-                -D GMX_MPI=ON \
+                -D GMX_MPI=$mpi$ \
                 -D GMX_GPU=$cuda$ \
                 -D GMX_SIMD=$simd$ \
                 -D GMX_USE_RDTSCP=$rdtscp$ \
@@ -37,7 +100,7 @@ class Gromacs:
                 -D $fft$ \
                 -D GMX_EXTERNAL_BLAS=OFF \
                 -D GMX_EXTERNAL_LAPACK=OFF \
-                -D BUILD_SHARED_LIBS=ON \
+                -D BUILD_SHARED_LIBS=$shared_libs$ \
                 -D GMX_PREFER_STATIC_LIBS=ON \
                 -D REGRESSIONTEST_DOWNLOAD=$regtest$ \
                 -D GMX_DEFAULT_SUFFIX=OFF \
@@ -45,9 +108,16 @@ class Gromacs:
                 -D GMX_LIBS_SUFFIX=$libs_suffix$ \
                 "
 
-    def __init__(self, *, stage_name, base_image, args, building_blocks):
+    def __init__(self, *, stage_name, base_image, args, building_blocks, build_graph):
         self.stage = hpccm.Stage()
+        self.stage_name = stage_name
         self.base_image = base_image
+        # stages building mpi and fftw
+        self.build_graph = build_graph
+        self.engines = parse_engines(args=args)
+        # regression test stages, one per engine
+        self.regtest = False
+        self.regtest_stages = collections.OrderedDict()
         # The following two will be required in generic_cmake
         self.check = False
         self.preconfigure = []
@@ -57,17 +127,19 @@ class Gromacs:
         self.__gromacs(args=args, building_blocks=building_blocks)
         self.__regtest(args=args)
         self.__add__engines(args=args, building_blocks=building_blocks)
+        self.manifest = self.__get_manifest(args=args, building_blocks=building_blocks)
 
     def __prepare(self, *, args, stage_name, building_blocks):
         '''
         Prepare the stage. Add the base image, ospackages, building blocks and
-        runtime for openmpi and fftw from previous stage
+        openmpi and fftw installations from previous stages
         '''
         self.stage += hpccm.primitives.baseimage(image=self.base_image, _as=stage_name)
-        self.stage += hpccm.building_blocks.packages(ospackages=self._os_packages)
+        self.stage += instrument(args=args, stage_name=stage_name, step='packages',
+                                 layer=hpccm.building_blocks.packages(ospackages=self._os_packages))
         for bb in ('compiler', 'cmake'):
             if building_blocks.get(bb, None) is not None:
-                self.stage += building_blocks[bb]
+                self.stage += instrument(args=args, stage_name=stage_name, step=bb, layer=building_blocks[bb])
 
         # fftw
         if args.fftw_container:
@@ -80,21 +152,17 @@ class Gromacs:
                                                 _mkdir=True,
                                                 src=['/usr/local/include'],
                                                 dest='/usr/local/fftw/include')
-        elif args.fftw:
-            self.stage += building_blocks['fftw'].runtime(_from='dev')
-
-        if args.fftw_container or args.fftw:
             self.stage += hpccm.primitives.environment(
                 variables={'CMAKE_PREFIX_PATH': '/usr/local/fftw:$CMAKE_PREFIX_PATH'}
             )
+
+        # fftw (one stage per precision) and mpi built in previous stages
+        self.stage += get_stage_copies(graph=self.build_graph, consumer=stage_name)
+
+        if args.fftw_container or args.fftw:
             # adding ninja build to cmake's build options for faster building process
             self._cmake_opts += '-G Ninja'
 
-        # mpi
-        if building_blocks.get('mpi', None) is not None:
-            # This means, mpi has been installed in the dev stage
-            self.stage += building_blocks['mpi'].runtime(_from='dev')
-
 
     def __gromacs(self, *, args, building_blocks):
         '''
@@ -114,30 +182,37 @@ class Gromacs:
 
         self.gromacs_cmake_opts = self.__get_gromacs_cmake_opts(args=args,
                                                                 building_blocks=building_blocks)
-        self.wrapper = 'gmx' + self.__get_wrapper_suffix(args=args,
-                                                         building_blocks=building_blocks)
+        # one wrapper per precision, e.g. gmx_mpi and gmx_mpi_d
+        self.wrappers = sorted(set('gmx' + self.__get_wrapper_suffix(engine['precision'],
+                                                                     building_blocks=building_blocks)
+                                   for engine in self.engines))
 
     def __regtest(self, *, args):
         if args.regtest:
-            # allow regression test
-            self.check = True
+            # allow regression test. Tests are not run while building the engines (check),
+            # but in separate stages, see __get_regtest_stage
+            self.regtest = True
 
     def __add__engines(self, *, args, building_blocks):
         '''
         Adding GROMACS engine to the container
         '''
-        # We dont want to use build the identical engine multiple times
-        for engine in set(args.engines):
+        # identical engines have already been removed while parsing
+        for parsed_engine in self.engines:
             # binary and library suffix for gmx
-            parsed_engine = self.__parse_engine(engine)
-            bin_libs_suffix = self.__get_bin_libs_suffix(parsed_engine['rdtscp'],
-                                                         args=args,
-                                                         building_blocks=building_blocks)
+            bin_libs_suffix = get_bin_libs_suffix(parsed_engine, building_blocks=building_blocks)
             engine_cmake_opts = self.gromacs_cmake_opts.replace('$bin_suffix$', bin_libs_suffix)
             engine_cmake_opts = engine_cmake_opts.replace('$libs_suffix$', bin_libs_suffix)
+            engine_cmake_opts = engine_cmake_opts.replace('$double$',
+                                                          'ON' if parsed_engine['precision'] == 'double' else 'OFF')
+            engine_name = parsed_engine['simd'] + bin_libs_suffix
+            build_directory = self.build_directory.format(simd=parsed_engine['simd'])
+            # fma units detection is only required for AVX_512 engines
+            self.preconfigure = []
+            self.postinstall = []
 
             # simd, rdtscp
-            for key in parsed_engine:
+            for key in ('simd', 'rdtscp'):
                 value = parsed_engine[key] if key == 'simd' else parsed_engine[key].upper()
                 engine_cmake_opts = engine_cmake_opts.replace('$' + key + '$', value)
 
@@ -164,46 +239,114 @@ class Gromacs:
                         simd=parsed_engine[key])
                     ]
 
+            if self.regtest:
+                self.postinstall = self.postinstall + self.__get_regtest_postinstall(engine_name=engine_name,
+                                                                                     simd=parsed_engine['simd'])
+                regtest_stage_name = get_regtest_stage_name(parsed_engine, building_blocks=building_blocks)
+                self.regtest_stages[regtest_stage_name] = self.__get_regtest_stage(
+                    stage_name=regtest_stage_name,
+                    engine_name=engine_name,
+                    engine=parsed_engine,
+                    args=args,
+                    building_blocks=building_blocks
+                )
+
+            # With build instrumentation, the build and install steps are moved to postinstall
+            # so that configure, compile and install can be timed separately
+            make = install = not args.instrument_build
+            if args.instrument_build:
+                self.preconfigure, self.postinstall = self.__get_instrumented_steps(engine_name=engine_name,
+                                                                                    build_directory=build_directory)
+
             self.stage += hpccm.building_blocks.generic_cmake(cmake_opts=engine_cmake_opts.split(),
                                                               directory=self.source_directory,
-                                                              build_directory=self.build_directory.format(simd=parsed_engine['simd']),
+                                                              build_directory=build_directory,
                                                               prefix=self.prefix,
                                                               build_environment=self.build_environment,
                                                               url=self.url,
                                                               check=self.check,
+                                                              make=make,
+                                                              install=install,
                                                               preconfigure=self.preconfigure,
                                                               postinstall=self.postinstall)
 
-    def __parse_engine(self, engine):
+    def __get_instrumented_steps(self, *, engine_name, build_directory):
         '''
-        Parsing engine's value
+        Surround the engine's configure, compile and install with timestamp markers.
+        Returns the preconfigure and postinstall commands for generic_cmake
         '''
-        if engine:
-            engine_args = map(lambda x: x.strip(), engine.split(':'))
-            engine_args_dict = {}
-            for engine_arg in engine_args:
-                key, value = map(lambda x: x.strip(), engine_arg.split('='))
+        build_directory = os.path.join('/var/tmp', self.source_directory, build_directory)
 
-                # Check engine argument and value
-                self.__check_engine_argument(key=key, value=value)
+        def marker(step, event):
+            return get_marker(stage_name=self.stage_name, step='{0}.{1}'.format(engine_name, step), event=event)
 
-                engine_args_dict[key] = config.SIMD_MAPPER[value] if key == 'simd' else value
-            return engine_args_dict
+        # postinstall commands run from the installation directory, so it has to exist
+        preconfigure = [marker('configure', 'start'), 'mkdir -p {}'.format(self.prefix)] + self.preconfigure
+        postinstall = [marker('configure', 'end'),
+                       marker('compile', 'start'),
+                       'cmake --build {} --target all -- -j$(nproc)'.format(build_directory),
+                       marker('compile', 'end'),
+                       marker('install', 'start'),
+                       'cmake --build {} --target install -- -j$(nproc)'.format(build_directory)]
+        postinstall += self.postinstall + [marker('install', 'end')]
 
-    def __check_engine_argument(self, *, key, value):
+        return (preconfigure, postinstall)
+
+    def __get_regtest_postinstall(self, *, engine_name, simd):
+        '''
+        Build the tests and keep the source and build tree of the engine,
+        as generic_cmake removes it after installation
+        '''
+        source_directory = os.path.join('/var/tmp', self.source_directory)
+        return ['cmake --build {build_directory} --target tests -- -j$(nproc)'.format(
+                    build_directory=os.path.join(source_directory, self.build_directory.format(simd=simd))),
+                'mkdir -p /var/tmp/regtest',
+                'cp -a {source_directory} /var/tmp/regtest/{engine_name}'.format(source_directory=source_directory,
+                                                                              engine_name=engine_name)]
+
+    def __get_regtest_stage(self, *, stage_name, engine_name, engine, args, building_blocks):
         '''
-        Check whether a value is missing in engines option
+        Stage running the regression tests of one engine with ctest. The outcome is
+        written to a json report that is copied to the final image. Failing tests fail
+        the stage, unless --regtest-allow-failures is given
         '''
-        if not key in config.ENGINE_OPTIONS.keys():
-            raise KeyError('{key} not valid engine key. Available keys are {keys}'.format(
-                key=key,
-                keys=config.ENGINE_OPTIONS['simd'])
+        source_directory = os.path.join('/var/tmp', self.source_directory)
+        scripts_directory = os.path.join(config.GMX_INSTALLATION_DIRECTORY, 'scripts')
+
+        stage = hpccm.Stage()
+        stage += hpccm.primitives.baseimage(image=self.base_image, _as=stage_name)
+        stage += hpccm.building_blocks.packages(ospackages=['perl', 'python3', 'hwloc', 'openssh-client'])
+        for bb in ('compiler', 'cmake'):
+            if building_blocks.get(bb, None) is not None:
+                stage += building_blocks[bb]
+
+        # dependencies from the stages building them, fftw from a container is taken from the gromacs stage
+        if args.fftw_container:
+            stage += hpccm.primitives.copy(_from=self.stage_name, src='/usr/local/fftw', dest='/usr/local/fftw')
+            stage += hpccm.primitives.environment(
+                variables={'LD_LIBRARY_PATH': '/usr/local/fftw/lib:$LD_LIBRARY_PATH'}
             )
-        else:
-            if not value in config.ENGINE_OPTIONS[key]:
-                raise ValueError('{value} is not valid value for key "{key}". Available values are : {values}'.format(
-                    value=value, key=key, values=config.ENGINE_OPTIONS[key])
-                )
+        stage += get_stage_copies(graph=self.build_graph, consumer=stage_name)
+
+        stage += hpccm.primitives.copy(_from=self.stage_name,
+                                       src=os.path.join('/var/tmp/regtest', engine_name),
+                                       dest=source_directory)
+        stage += hpccm.primitives.copy(_from=self.stage_name, src=self.prefix, dest=self.prefix)
+
+        stage += hpccm.primitives.copy(src='/scripts/regtest.py', dest=os.path.join(scripts_directory, 'regtest.py'))
+        stage += hpccm.primitives.copy(src='config.py', dest=os.path.join(scripts_directory, 'config.py'))
+        stage += instrument(args=args, stage_name=stage_name, step='regtest', layer=hpccm.primitives.shell(commands=[
+            'python3 {script} --build-directory {build_directory} --simd {simd} --rdtscp {rdtscp} --precision {precision} --report {report}{allow_failures}'.format(
+                script=os.path.join(scripts_directory, 'regtest.py'),
+                build_directory=os.path.join(source_directory, self.build_directory.format(simd=engine['simd'])),
+                simd=engine['simd'],
+                rdtscp=engine['rdtscp'],
+                precision=engine['precision'],
+                report=os.path.join(config.GMX_REGTEST_DIRECTORY, engine_name + '.json'),
+                allow_failures=' --allow-failures' if args.regtest_allow_failures else '')
+        ]))
+
+        return stage
 
     def __get_gromacs_cmake_opts(self, *, args, building_blocks):
         '''
@@ -221,7 +364,8 @@ class Gromacs:
         else:
             gromacs_cmake_opts = gromacs_cmake_opts.replace('$c_compiler$', 'gcc')
             gromacs_cmake_opts = gromacs_cmake_opts.replace('$cxx_compiler$', 'g++')
-            gromacs_cmake_opts = gromacs_cmake_opts.replace('$mpi$', 'ON')
+            # engines without mpi library are built with thread-MPI
+            gromacs_cmake_opts = gromacs_cmake_opts.replace('$mpi$', 'OFF')
 
         #  fftw
         if args.fftw or args.fftw_container:
@@ -230,37 +374,70 @@ class Gromacs:
         else:
             gromacs_cmake_opts = gromacs_cmake_opts.replace('$fft$', 'GMX_BUILD_OWN_FFTW=ON')
 
-        # cuda, regtest, double
-        for (option, enabled) in zip(['cuda', 'regtest', 'double'], [args.cuda, args.regtest, args.double]):
+        # linking. With static linking, the engines' libraries are not loaded at runtime, and
+        # the libraries that stay shared (mpi) are found through LD_LIBRARY_PATH, so no rpath is needed
+        if args.link == 'static':
+            gromacs_cmake_opts = gromacs_cmake_opts.replace('$shared_libs$', 'OFF')
+            gromacs_cmake_opts = gromacs_cmake_opts + ' -D CMAKE_SKIP_INSTALL_RPATH=ON'
+        else:
+            gromacs_cmake_opts = gromacs_cmake_opts.replace('$shared_libs$', 'ON')
+
+        if args.lto:
+            gromacs_cmake_opts = gromacs_cmake_opts + ' -D CMAKE_INTERPROCEDURAL_OPTIMIZATION=ON'
+
+        # cuda, regtest. Precision is set per engine
+        for (option, enabled, value) in zip(['cuda', 'regtest'], [args.cuda, args.regtest], ['CUDA', 'ON']):
             if enabled:
-                gromacs_cmake_opts = gromacs_cmake_opts.replace('$' + option + '$', 'CUDA')
+                gromacs_cmake_opts = gromacs_cmake_opts.replace('$' + option + '$', value)
             else:
                 gromacs_cmake_opts = gromacs_cmake_opts.replace('$' + option + '$', 'OFF')
 
         return gromacs_cmake_opts
 
-    def __get_wrapper_suffix(self, *, args, building_blocks):
+    def __get_manifest(self, *, args, building_blocks):
+        '''
+        Machine-readable description of the engines in the image: binary, wrapper and
+        the cpu flags required to run each of them
+        '''
+        simd_options = {value: key for key, value in config.SIMD_MAPPER.items()}
+        engines = []
+        for engine in self.engines:
+            cpu_flags = [config.SIMD_CPU_FLAGS[simd_options[engine['simd']]]]
+            if engine['rdtscp'] == 'on':
+                cpu_flags.append(config.RDTSCP_CPU_FLAG)
+            engines.append(collections.OrderedDict([
+                ('simd', engine['simd']),
+                ('rdtscp', engine['rdtscp']),
+                ('precision', engine['precision']),
+                ('wrapper', 'gmx' + self.__get_wrapper_suffix(engine['precision'], building_blocks=building_blocks)),
+                ('binary', 'gmx' + get_bin_libs_suffix(engine, building_blocks=building_blocks)),
+                ('directory', config.GMX_BINARY_DIRECTORY.format(engine['simd'])),
+                ('thread_mpi', building_blocks.get('mpi', None) is None),
+                ('cpu_flags', cpu_flags)
+            ]))
+
+        return collections.OrderedDict([
+            ('gromacs', args.gromacs),
+            ('mpi', args.openmpi if building_blocks.get('mpi', None) is not None else None),
+            ('cuda', args.cuda),
+            ('link', args.link),
+            ('allocator', args.allocator),
+            ('wrappers', self.wrappers),
+            ('engines', engines)
+        ])
+
+    def __get_wrapper_suffix(self, precision, *, building_blocks):
         '''
         Set the wrapper suffix based on mpi enabled/disabled and
-        double precision enabled and disabled
+        the engine's precision
         '''
         return config.WRAPPER_SUFFIX_FORMAT.format(
             mpi=config.GMX_ENGINE_SUFFIX_OPTIONS['mpi'] if building_blocks.get('mpi', None) is not None else '',
-            double=config.GMX_ENGINE_SUFFIX_OPTIONS['double'] if args.double else ''
+            double=config.GMX_ENGINE_SUFFIX_OPTIONS['double'] if precision == 'double' else ''
         )
 
-    def __get_bin_libs_suffix(self, rdtscp, *, args, building_blocks):
-        '''
-        Set gmx binaries and library suffix based on mpi enabled/disabled,
-        double precision enabled and disabled and
-        rdtscp enabled/disabled
-        '''
-        return config.BINARY_SUFFIX_FORMAT.format(mpi=config.GMX_ENGINE_SUFFIX_OPTIONS['mpi'] if building_blocks.get('mpi', None) is not None else '',
-                                                  double=config.GMX_ENGINE_SUFFIX_OPTIONS['double'] if args.double else '',
-                                                  rdtscp=config.GMX_ENGINE_SUFFIX_OPTIONS['rdtscp'] if rdtscp.lower() == 'on' else '')
-
     def __call__(self):
         '''
-        Return the stage and the name of the wrapper binaries
+        Return the stage and the engine manifest, listing the wrapper binaries
         '''
-        return (self.stage, self.wrapper)
+        return (self.stage, self.manifest)
@@ -0,0 +1,96 @@
+'''
+Author :
+    * Muhammed Ahad <ahad3112@yahoo.com, maaahad@gmail.com>
+'''
+
+import collections
+
+import hpccm
+
+import config
+
+
+def get_build_graph(*, args, building_blocks, build_stages, deploy_stage):
+    '''
+    Building blocks built from sources, keyed by the name of the stage building them.
+    This is a flat set of independent nodes (e.g. mpi and fftw don't depend on each
+    other), so that every node is built in a stage of its own and all of them can be
+    built in parallel. The only edges go from a node to the stages consuming it:
+        requires    : tools (compiler, cmake) installed in its stage before building it
+        required_by : names of the stages copying the node's installation (build_stages,
+                      i.e. gromacs and regtest) or runtime (deploy_stage)
+    Nodes are only created for the building blocks in use, so that no empty stage is generated
+    '''
+    graph = collections.OrderedDict()
+
+    if building_blocks.get('mpi', None) is not None:
+        graph['mpi'] = {
+            'building_block': building_blocks['mpi'],
+            'requires': ['compiler'],
+            'required_by': build_stages + [deploy_stage],
+            'prefix': '/usr/local/openmpi',
+            'environment': {'PATH': '/usr/local/openmpi/bin',
+                            'LD_LIBRARY_PATH': '/usr/local/openmpi/lib'},
+            # cuda aware mpi
+            'cuda': args.cuda is not None,
+            'ospackages': []
+        }
+
+    for precision, fftw in building_blocks.get('fftw', {}).items():
+        graph['fftw.' + precision] = {
+            'building_block': fftw,
+            'requires': ['compiler'],
+            # static engines have fftw linked in
+            'required_by': build_stages + ([deploy_stage] if args.link == 'shared' else []),
+            'prefix': '/usr/local/fftw',
+            'environment': {'LD_LIBRARY_PATH': '/usr/local/fftw/lib',
+                            'CMAKE_PREFIX_PATH': '/usr/local/fftw'},
+            'cuda': False,
+            'ospackages': []
+        }
+
+    if building_blocks.get('allocator', None) is not None:
+        graph['allocator'] = {
+            'building_block': building_blocks['allocator'],
+            'requires': ['compiler', 'cmake'] if args.allocator == 'mimalloc' else ['compiler'],
+            'required_by': [deploy_stage],
+            'prefix': config.ALLOCATOR_DIRECTORY,
+            'environment': {},
+            'cuda': False,
+            'ospackages': ['bzip2', 'ca-certificates', 'make', 'tar', 'wget']
+        }
+
+    return graph
+
+
+def check_build_graph(*, graph, stages):
+    '''
+    Every consumer of a node must be a generated stage, otherwise its copies would
+    silently be missing (e.g. after renaming a stage)
+    '''
+    for node_stage_name, node in graph.items():
+        for consumer in node['required_by']:
+            if consumer not in stages:
+                raise RuntimeError('{0} is required by {1}, which is not a stage of the recipe.'.format(
+                    node_stage_name, consumer))
+
+
+def get_stage_copies(*, graph, consumer):
+    '''
+    Copy the installation of every node required by the consumer stage, and set the
+    environment variables for all of them at once
+    '''
+    layers = []
+    environment = collections.OrderedDict()
+    for stage_name, node in graph.items():
+        if consumer in node['required_by']:
+            layers.append(hpccm.primitives.copy(_from=stage_name, src=node['prefix'], dest=node['prefix']))
+            for variable, path in node['environment'].items():
+                value = environment.get(variable, '$' + variable)
+                if path not in value.split(':'):
+                    environment[variable] = path + ':' + value
+
+    if environment:
+        layers.append(hpccm.primitives.environment(variables=environment))
+
+    return layers
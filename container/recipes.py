@@ -6,13 +6,16 @@ Author :
 from __future__ import print_function
 import os
 import sys
+import json
 import collections
 from distutils.version import StrictVersion
 
 import hpccm
 
 import config
-from container.apps import Gromacs
+from container.apps import Gromacs, parse_engines, get_regtest_stage_name
+from container.graph import get_build_graph, check_build_graph
+from container.timings import instrument, get_stage_dependencies
 
 
 # current module
@@ -99,54 +102,138 @@ def get_cmake(*, args, building_blocks):
     building_blocks['cmake'] = hpccm.building_blocks.cmake(eula=True, version=args.cmake)
 
 
-def get_fftw(*, args, building_blocks, configure_opts=[], prefix='/usr/local/fftw'):
+def get_allocator(*, args, building_blocks):
     '''
-    fftw :
+    Memory allocator to be preloaded for the engines, built from source so that
+    it is installed at the same location whatever the linux distribution
+    '''
+    if args.allocator == 'glibc':
+        return
+
+    version = config.ALLOCATOR_VERSIONS[args.allocator]
+    prefix = config.ALLOCATOR_DIRECTORY
+    if args.allocator == 'jemalloc':
+        building_blocks['allocator'] = hpccm.building_blocks.generic_autotools(
+            url='https://github.com/jemalloc/jemalloc/releases/download/{0}/jemalloc-{0}.tar.bz2'.format(version),
+            prefix=prefix,
+            toolchain=building_blocks['compiler'].toolchain
+        )
+    elif args.allocator == 'tcmalloc':
+        building_blocks['allocator'] = hpccm.building_blocks.generic_autotools(
+            url='https://github.com/gperftools/gperftools/releases/download/gperftools-{0}/gperftools-{0}.tar.gz'.format(version),
+            prefix=prefix,
+            enable_minimal=True,
+            toolchain=building_blocks['compiler'].toolchain
+        )
+    elif args.allocator == 'mimalloc':
+        building_blocks['allocator'] = hpccm.building_blocks.generic_cmake(
+            url='https://github.com/microsoft/mimalloc/archive/v{0}.tar.gz'.format(version),
+            directory='mimalloc-{0}'.format(version),
+            prefix=prefix,
+            cmake_opts=['-D CMAKE_BUILD_TYPE=Release', '-D MI_INSTALL_TOPLEVEL=ON', '-D MI_BUILD_TESTS=OFF']
+        )
+    else:
+        raise RuntimeError('{0} allocator is not supported.'.format(args.allocator))
+
+
+def get_precisions(*, args):
+    '''
+    Identify the floating point precisions required by the GROMACS engines
+    '''
+    engine_precisions = set(engine['precision'] for engine in parse_engines(args=args))
+    precisions = [precision for precision in config.PRECISIONS if precision in engine_precisions]
+    # an FFTW container provides a single precision of FFTW
+    if args.fftw_container and len(precisions) > 1:
+        raise RuntimeError('--fftw-container provides FFTW in one precision only, '
+                           'engines can not be built in both single and double precision.')
+    return precisions
+
+
+def get_fftw(*, args, building_blocks, precisions, configure_opts=[], prefix='/usr/local/fftw', shared=True, threads=False):
+    '''
+    fftw : one building block per precision
     '''
     if args.fftw is not None:
         if building_blocks.get('compiler', None) is not None:
             if hasattr(building_blocks['compiler'], 'toolchain'):
-                configure_opts.extend(['--enable-shared', '--disable-static'])
-                if not args.double:
-                    configure_opts.append('--enable-float')
-
-                building_blocks['fftw'] = hpccm.building_blocks.fftw(toolchain=building_blocks['compiler'].toolchain,
-                                                                     configure_opts=configure_opts,
-                                                                     prefix=prefix,
-                                                                     version=args.fftw)
+                if shared:
+                    configure_opts = configure_opts + ['--enable-shared', '--disable-static']
+                else:
+                    configure_opts = configure_opts + ['--enable-static', '--disable-shared', '--with-pic']
+                if threads:
+                    configure_opts = configure_opts + ['--enable-threads']
+
+                building_blocks['fftw'] = collections.OrderedDict()
+                for precision in precisions:
+                    building_blocks['fftw'][precision] = hpccm.building_blocks.fftw(
+                        toolchain=building_blocks['compiler'].toolchain,
+                        configure_opts=configure_opts + (['--enable-float'] if precision == 'single' else []),
+                        prefix=prefix,
+                        version=args.fftw
+                    )
             else:
                 raise RuntimeError('compiler is not an HPCCM building block')
         else:
             raise RuntimeError('No compiler is available.')
 
 
-def get_dev_stage(*, stage_name='dev', args, building_blocks):
+def get_fftw_wisdom_commands(*, args, precisions, prefix):
     '''
-    This is the initial/development stage reponsible for building images with
-    all required dependencies such as openmpi, fftw for GROMACS
+    Commands generating FFTW wisdom for the requested transform sizes and thread counts.
+    Wisdom is written to FFTW's system wisdom file, and as fftw-wisdom imports the
+    system wisdom by default, every run accumulates on top of the previous one
+    '''
+    problems = ' '.join(problem + size
+                        for size in (args.fftw_wisdom or config.DEFAULT_FFTW_WISDOM_SIZES)
+                        for problem in config.FFTW_WISDOM_PROBLEMS)
+
+    commands = ['mkdir -p {}'.format(config.FFTW_WISDOM_DIRECTORY)]
+    for precision in precisions:
+        wisdom = os.path.join(config.FFTW_WISDOM_DIRECTORY, config.FFTW_WISDOM_FILES[precision])
+        for threads in args.fftw_wisdom_threads:
+            commands.append('{tool} -v -T {threads} -o {wisdom}.tmp {problems} && mv {wisdom}.tmp {wisdom}'.format(
+                tool=os.path.join(prefix, 'bin', config.FFTW_WISDOM_TOOLS[precision]),
+                threads=threads,
+                wisdom=wisdom,
+                problems=problems)
+            )
+
+    return commands
+
+
+def get_build_stage(*, stage_name, node, args, building_blocks):
+    '''
+    Stage building one node of the build graph (e.g. mpi, fftw, allocator) on top
+    of the tools it requires. Nodes are independent, so these stages are built in parallel
     '''
     stage = hpccm.Stage()
-    stage += hpccm.primitives.baseimage(image=get_base_image(args=args, cuda=args.cuda),
+    stage += hpccm.primitives.baseimage(image=get_base_image(args=args, cuda=args.cuda if node['cuda'] else None),
                                          _as=stage_name)
-
-    for bb in ('compiler', 'mpi', 'cmake', 'fftw'):
-        if building_blocks.get(bb, None) is not None:
-            stage += building_blocks[bb]
+    if node['ospackages']:
+        stage += instrument(args=args, stage_name=stage_name, step='packages',
+                            layer=hpccm.building_blocks.packages(ospackages=node['ospackages']))
+    for bb in node['requires']:
+        stage += instrument(args=args, stage_name=stage_name, step=bb, layer=building_blocks[bb])
+    stage += instrument(args=args, stage_name=stage_name, step=stage_name, layer=node['building_block'])
 
     return stage
 
 
-def get_deployment_stage(*, args, previous_stages, building_blocks, wrapper):
+def get_deployment_stage(*, stage_name, args, previous_stages, building_blocks, build_graph, manifest,
+                         dependencies):
     '''
     This deploy the GROMACS along with it dependencies (fftw, mpi) to the final image
     '''
     stage = hpccm.Stage()
     stage += hpccm.primitives.baseimage(image=get_base_image(args=args, cuda=args.cuda))
-    stage += hpccm.building_blocks.python(python3=True, python2=False, devel=False)
-    stage += hpccm.building_blocks.packages(ospackages=os_packages)
+    stage += instrument(args=args, stage_name=stage_name, step='python',
+                        layer=hpccm.building_blocks.python(python3=True, python2=False, devel=False))
+    stage += instrument(args=args, stage_name=stage_name, step='packages',
+                        layer=hpccm.building_blocks.packages(ospackages=os_packages))
 
     # adding runtime from compiler
-    stage += building_blocks['compiler'].runtime()
+    stage += instrument(args=args, stage_name=stage_name, step='compiler',
+                        layer=building_blocks['compiler'].runtime())
 
     # adding runtime from previous stages/provided container
     # fftw
@@ -165,34 +252,69 @@ def get_deployment_stage(*, args, previous_stages, building_blocks, wrapper):
             variables={'LD_LIBRARY_PATH': '/usr/local/fftw/lib:$LD_LIBRARY_PATH'}
         )
 
-    elif args.fftw:
-        # library path will be added automatically by runtime
-        stage += building_blocks['fftw'].runtime(_from='dev')
-
-
-    # mpi
-    if building_blocks.get('mpi', None) is not None:
-        # This means, mpi has been installed in the dev stage
-        stage += building_blocks['mpi'].runtime(_from='dev')
-
+    # fftw, mpi, memory allocator built in the previous stages.
+    # library path will be added automatically by runtime
+    for node_stage_name, node in build_graph.items():
+        if stage_name in node['required_by']:
+            stage += node['building_block'].runtime(_from=node_stage_name)
 
     if previous_stages.get('gromacs', None) is not None:
         stage += hpccm.primitives.copy(_from='gromacs',
                                        _mkdir=True,
                                        src=['/usr/local/gromacs'],
                                        dest='/usr/local/gromacs')
+    # regression test reports
+    for previous_stage in previous_stages:
+        if previous_stage.startswith('regtest.'):
+            stage += hpccm.primitives.copy(_from=previous_stage,
+                                           _mkdir=True,
+                                           src=[config.GMX_REGTEST_DIRECTORY + '/'],
+                                           dest=config.GMX_REGTEST_DIRECTORY)
+
+    # engine manifest, installed as a file and as image labels so that schedulers
+    # can match the engines against a node's cpu flags (see engine_query.py)
+    engines = json.dumps(manifest, separators=(',', ':'))
+    if previous_stages.get('gromacs', None) is not None:
+        stage += hpccm.primitives.shell(commands=["echo '{0}' > {1}".format(engines, config.ENGINE_MANIFEST_FILE)])
+
+    stage += hpccm.primitives.label(metadata={
+        'gromacs.version': args.gromacs,
+        'gromacs.simd': ','.join(collections.OrderedDict.fromkeys(engine['simd'] for engine in manifest['engines'])),
+        'gromacs.mpi': manifest['mpi'] or 'none',
+        'gromacs.cuda': manifest['cuda'] or 'none',
+        'gromacs.link': args.link,
+        'gromacs.allocator': args.allocator,
+        # off, required (the image only builds when no test fails) or allow-failures
+        'gromacs.regtest': ('allow-failures' if args.regtest_allow_failures else 'required') if args.regtest else 'off',
+        # docker splits label values on quotes and spaces, singularity doesn't
+        config.ENGINE_MANIFEST_LABEL: "'{0}'".format(engines) if args.format == 'docker' else engines
+    })
+
     # wrapper and gmx_chooser scripts
     scripts_directory = os.path.join(config.GMX_INSTALLATION_DIRECTORY, 'scripts')
 
     stage += hpccm.primitives.shell(commands=['mkdir -p {}'.format(scripts_directory)])
 
-    # setting wrapper sctipt
-    wrapper = os.path.join(scripts_directory, wrapper)
-    stage += hpccm.primitives.copy(src='/scripts/wrapper.py', dest=wrapper)
+    # setting wrapper sctipt, one per precision
+    for wrapper in manifest['wrappers']:
+        stage += hpccm.primitives.copy(src='/scripts/wrapper.py', dest=os.path.join(scripts_directory, wrapper))
 
     # copying the gmx_chooser script
     stage += hpccm.primitives.copy(src='/scripts/gmx_chooser.py',
                                    dest=os.path.join(scripts_directory, 'gmx_chooser.py'))
+    # node-local scratch staging, used by the wrapper for mdrun
+    stage += hpccm.primitives.copy(src='/scripts/scratch.py',
+                                   dest=os.path.join(scripts_directory, 'scratch.py'))
+    # tpr header reader, used by the chooser for mdrun
+    stage += hpccm.primitives.copy(src='/scripts/tpr.py',
+                                   dest=os.path.join(scripts_directory, 'tpr.py'))
+    # engine manifest query tool
+    stage += hpccm.primitives.copy(src='/scripts/engine_query.py',
+                                   dest=os.path.join(scripts_directory, 'engine_query.py'))
+    # build timings report tool
+    if args.instrument_build:
+        stage += hpccm.primitives.copy(src='/scripts/build_timings.py',
+                                       dest=os.path.join(scripts_directory, 'build_timings.py'))
     # mod changing for the files in the directory scripts
     stage += hpccm.primitives.shell(commands=['chmod +x {}'.format(
         os.path.join(scripts_directory, '*')
@@ -202,7 +324,33 @@ def get_deployment_stage(*, args, previous_stages, building_blocks, wrapper):
     stage += hpccm.primitives.copy(src='config.py',
                                    dest=os.path.join(scripts_directory, 'config.py'))
     # setting environment variable so to make wrapper available to PATH
-    stage += hpccm.primitives.environment(variables={'PATH': '{}:$PATH'.format(scripts_directory)})
+    stage += hpccm.primitives.environment(variables={'PATH': '{}:$PATH'.format(scripts_directory),
+                                                     config.ALLOCATOR_VARIABLE: args.allocator,
+                                                     config.GMX_VERSION_VARIABLE: args.gromacs})
+    # the wrapper preloads the allocator from this path, the image must not claim an allocator it can't preload
+    if args.allocator in config.ALLOCATOR_LIBRARIES:
+        library = os.path.join(config.ALLOCATOR_DIRECTORY, 'lib', config.ALLOCATOR_LIBRARIES[args.allocator])
+        stage += hpccm.primitives.shell(commands=[
+            'test -f {0} || (echo "{1} library {0} is missing" && exit 1)'.format(library, args.allocator)])
+
+    # collecting the timing logs of all stages into a single json file, together with
+    # the stages' dependencies for the critical path. This stage copies from all of them
+    if args.instrument_build:
+        dependencies = collections.OrderedDict(dependencies)
+        dependencies[stage_name] = list(previous_stages)
+        for previous_stage in previous_stages:
+            stage += hpccm.primitives.copy(_from=previous_stage,
+                                           _mkdir=True,
+                                           src=[config.BUILD_TIMINGS_LOG_DIRECTORY + '/'],
+                                           dest=config.BUILD_TIMINGS_LOG_DIRECTORY)
+        stage += hpccm.primitives.shell(commands=[
+            "python3 {script} collect --logs {logs} --output {output} --dependencies '{dependencies}'".format(
+                script=os.path.join(scripts_directory, 'build_timings.py'),
+                logs=config.BUILD_TIMINGS_LOG_DIRECTORY,
+                output=config.BUILD_TIMINGS_FILE,
+                dependencies=json.dumps(dependencies, separators=(',', ':'))),
+            'rm -rf {}'.format(config.BUILD_TIMINGS_LOG_DIRECTORY)
+        ])
 
     return stage
 
@@ -216,13 +364,24 @@ def prepare_and_cook_fftw(*, args):
     building_blocks = collections.OrderedDict()
 
     get_compiler(args=args, building_blocks=building_blocks)
+    precisions = ['double' if args.double else 'single']
     get_fftw(args=args,
              building_blocks=building_blocks,
+             precisions=precisions,
              configure_opts=['--enable-' + simd for simd in args.simd],
-             prefix='/usr/local')
+             prefix='/usr/local',
+             # multi-threaded wisdom requires threaded fftw
+             threads=args.fftw_wisdom is not None and any(threads > 1 for threads in args.fftw_wisdom_threads))
+
+    stage += building_blocks['compiler']
+    for precision in precisions:
+        stage += building_blocks['fftw'][precision]
 
-    for bb in building_blocks:
-        stage += building_blocks[bb]
+    # fftw wisdom
+    if args.fftw_wisdom is not None:
+        stage += hpccm.primitives.shell(commands=get_fftw_wisdom_commands(args=args,
+                                                                          precisions=precisions,
+                                                                          prefix='/usr/local'))
 
     print(stage)
 
@@ -233,30 +392,59 @@ def prepare_and_cook_gromacs(*, args):
     stages = collections.OrderedDict()
     building_blocks = collections.OrderedDict()
 
+    # an FFTW container provides shared FFTW libraries only
+    if args.link == 'static' and args.fftw_container:
+        raise RuntimeError('--link static requires FFTW to be built with --fftw (or by GROMACS), '
+                           'not provided by --fftw-container.')
+    if args.regtest_allow_failures and not args.regtest:
+        raise RuntimeError('--regtest-allow-failures requires --regtest.')
 
     get_compiler(args=args, building_blocks=building_blocks)
     get_mpi(args=args, building_blocks=building_blocks)
     get_cmake(args=args, building_blocks=building_blocks)
+    get_allocator(args=args, building_blocks=building_blocks)
+    precisions = get_precisions(args=args)
     get_fftw(args=args,
              building_blocks=building_blocks,
+             precisions=precisions,
              configure_opts=['--enable-sse2','--enable-avx',
-                             '--enable-avx2', '--enable-avx512']
+                             '--enable-avx2', '--enable-avx512'],
+             shared=args.link == 'shared'
              )
 
     # create stages
-    # development stage
-    stages['dev'] = get_dev_stage(stage_name='dev', args=args, building_blocks=building_blocks)
+    # one stage per node of the build graph: mpi, fftw (one per precision), allocator
+    # stages consuming the nodes: gromacs, regtest (one per engine) and deploy
+    regtest_stages = [get_regtest_stage_name(engine, building_blocks=building_blocks)
+                      for engine in parse_engines(args=args)] if args.regtest else []
+    build_graph = get_build_graph(args=args,
+                                  building_blocks=building_blocks,
+                                  build_stages=['gromacs'] + regtest_stages,
+                                  deploy_stage='deploy')
+    for stage_name, node in build_graph.items():
+        stages[stage_name] = get_build_stage(stage_name=stage_name,
+                                             node=node,
+                                             args=args,
+                                             building_blocks=building_blocks)
     # Gromacs stage
-    stages['gromacs'], wrapper = Gromacs(stage_name='gromacs',
-                                         base_image=get_base_image(args=args, cuda=args.cuda),
-                                         args=args,
-                                         building_blocks=building_blocks)()
+    gromacs = Gromacs(stage_name='gromacs',
+                      base_image=get_base_image(args=args, cuda=args.cuda),
+                      args=args,
+                      building_blocks=building_blocks,
+                      build_graph=build_graph)
+    stages['gromacs'], manifest = gromacs()
+    # regression test stages, one per engine
+    stages.update(gromacs.regtest_stages)
 
     # deployment stage
-    stages['deploy'] = get_deployment_stage(args=args,
+    stages['deploy'] = get_deployment_stage(stage_name='deploy',
+                                            args=args,
                                             previous_stages=stages,
                                             building_blocks=building_blocks,
-                                            wrapper=wrapper)
+                                            build_graph=build_graph,
+                                            manifest=manifest,
+                                            dependencies=get_stage_dependencies(stages=stages))
+    check_build_graph(graph=build_graph, stages=stages)
 
 
     # cooking
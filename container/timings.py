@@ -0,0 +1,54 @@
+'''
+Author :
+    * Muhammed Ahad <ahad3112@yahoo.com, maaahad@gmail.com>
+'''
+
+import os
+import re
+import collections
+
+import hpccm
+
+import config
+
+
+def get_marker(*, stage_name, step, event):
+    '''
+    Shell command appending a timestamp marker to the stage's timing log.
+    event is either start or end
+    '''
+    return 'mkdir -p {directory} && echo "{stage} {step} {event} $(date +%s.%N)" >> {log}'.format(
+        directory=config.BUILD_TIMINGS_LOG_DIRECTORY,
+        stage=stage_name,
+        step=step,
+        event=event,
+        log=os.path.join(config.BUILD_TIMINGS_LOG_DIRECTORY, stage_name + '.log')
+    )
+
+
+def instrument(*, args, stage_name, step, layer):
+    '''
+    Wrap a building block or primitive with start and end markers if
+    build instrumentation is enabled. The result can be added to a stage
+    '''
+    if not args.instrument_build:
+        return [layer]
+
+    return [hpccm.primitives.shell(commands=[get_marker(stage_name=stage_name, step=step, event='start')]),
+            layer,
+            hpccm.primitives.shell(commands=[get_marker(stage_name=stage_name, step=step, event='end')])]
+
+
+def get_stage_dependencies(*, stages):
+    '''
+    For every stage, the stages it copies from (COPY --from, %files from), i.e. the stages it
+    waits for when stages are built in parallel. Images (e.g. --fftw-container) are left out
+    '''
+    dependencies = collections.OrderedDict()
+    for stage_name, stage in stages.items():
+        if stage is None:
+            continue
+        sources = re.findall(r'(?:--from=|%files from )(\S+)', str(stage))
+        dependencies[stage_name] = [source for source in collections.OrderedDict.fromkeys(sources)
+                                    if source in stages and source != stage_name]
+    return dependencies
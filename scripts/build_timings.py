@@ -0,0 +1,117 @@
+#!/usr/bin/env python3
+
+'''
+Author :
+    * Muhammed Ahad <ahad3112@yahoo.com, maaahad@gmail.com>
+
+Usage:
+    $ python3 build_timings.py -h/--help
+Description:
+    Collects the timestamp markers written by the build steps of every stage
+    (--instrument-build) into a single json file, and reports the time spent
+    in each stage together with the critical path across stages. The critical
+    path follows the stages' dependencies (COPY --from), given when collecting.
+'''
+
+import os
+import json
+import argparse
+import config
+
+
+# Each line of a stage's log: <stage> <step> <start|end> <seconds since epoch>
+def read_logs(logs):
+    markers = {}
+    for log in sorted(os.listdir(logs)):
+        with open(os.path.join(logs, log)) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                stage, step, event, timestamp = line.split()
+                markers.setdefault(stage, {}).setdefault(step, {})[event] = float(timestamp)
+    return markers
+
+
+def collect(logs, output, dependencies):
+    stages = {}
+    for stage, steps in read_logs(logs).items():
+        # steps without both markers (e.g. interrupted and later cached) are left out
+        steps = [{'step': step, 'start': times['start'], 'end': times['end'],
+                  'seconds': round(times['end'] - times['start'], 3)}
+                 for step, times in steps.items() if 'start' in times and 'end' in times]
+        steps.sort(key=lambda step: step['start'])
+        if steps:
+            stages[stage] = {'start': steps[0]['start'],
+                             'end': steps[-1]['end'],
+                             'seconds': round(steps[-1]['end'] - steps[0]['start'], 3),
+                             'steps': steps}
+
+    with open(output, 'w') as f:
+        json.dump({'stages': stages, 'dependencies': dependencies}, f, indent=2)
+
+
+# Walks back from the last step to finish. Within a stage steps are serial, but the
+# first steps of a stage run alongside the stages it depends on, and it only waits
+# for them at COPY --from. So the predecessor of a step is whichever finished last
+# before it started: the previous step of its stage or the last step of a dependency
+def get_critical_path(stages, dependencies):
+    current_stage = max(stages, key=lambda stage: stages[stage]['end'])
+    index = len(stages[current_stage]['steps']) - 1
+    path = []
+    while True:
+        step = stages[current_stage]['steps'][index]
+        path.append((current_stage, step))
+        candidates = [(current_stage, index - 1)] if index > 0 else []
+        candidates += [(stage, len(stages[stage]['steps']) - 1)
+                       for stage in dependencies.get(current_stage, [])
+                       if stage in stages and stages[stage]['end'] <= step['start']]
+        if not candidates:
+            break
+        current_stage, index = max(candidates, key=lambda candidate: stages[candidate[0]]['steps'][candidate[1]]['end'])
+    return list(reversed(path))
+
+
+def report(timings):
+    with open(timings) as f:
+        timings = json.load(f)
+    stages = timings['stages']
+
+    if not stages:
+        print('No build timings recorded.')
+        return
+
+    print('{0:<32} {1:>10}'.format('stage', 'seconds'))
+    for stage in sorted(stages, key=lambda stage: stages[stage]['start']):
+        print('{0:<32} {1:>10.1f}'.format(stage, stages[stage]['seconds']))
+
+    path = get_critical_path(stages, timings.get('dependencies', {}))
+    print('\nCritical path:')
+    for stage, step in path:
+        print('{0:<32} {1:<40} {2:>10.1f}'.format(stage, step['step'], step['seconds']))
+
+    total = path[-1][1]['end'] - path[0][1]['start']
+    steps = sum(step['seconds'] for _, step in path)
+    print('\nElapsed along the critical path: {0:.1f} s ({1:.1f} s in instrumented steps)'.format(total, steps))
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Collect and report GROMACS image build timings.')
+    # add_subparsers(required=True) needs python 3.7, images may have python 3.6
+    subparsers = parser.add_subparsers(dest='command')
+
+    collect_parser = subparsers.add_parser('collect', help='collect the stages\' logs into a json file')
+    collect_parser.add_argument('--logs', default=config.BUILD_TIMINGS_LOG_DIRECTORY)
+    collect_parser.add_argument('--output', default=config.BUILD_TIMINGS_FILE)
+    collect_parser.add_argument('--dependencies', type=json.loads, default={},
+                                help='json object listing, for every stage, the stages it copies from.')
+
+    report_parser = subparsers.add_parser('report', help='report stage timings and the critical path')
+    report_parser.add_argument('timings', nargs='?', default=config.BUILD_TIMINGS_FILE)
+
+    args = parser.parse_args()
+    if args.command is None:
+        parser.error('a command is required: collect or report')
+    if args.command == 'collect':
+        collect(args.logs, args.output, args.dependencies)
+    else:
+        report(args.timings)
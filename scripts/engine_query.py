@@ -0,0 +1,99 @@
+#!/usr/bin/env python3
+
+'''
+Author :
+    * Muhammed Ahad <ahad3112@yahoo.com, maaahad@gmail.com>
+
+Usage:
+    $ python3 engine_query.py -h/--help
+Description:
+    Matches the engine manifest of an image against a node's cpu flags, and reports
+    for every wrapper the engine the chooser would run on that node. The manifest is
+    read from the image (engines.json), or from the image labels without starting it:
+        $ docker inspect <image_name> | engine_query.py --manifest - --cpuinfo <node cpuinfo>
+    Exits with 1 if a wrapper has no engine able to run on the node (or, with
+    --strict, if the node would run an engine below its best SIMD instruction set).
+'''
+
+import sys
+import json
+import argparse
+import config
+
+
+def get_cpu_flags(path):
+    with open(path) as cpuinfo:
+        for line in cpuinfo:
+            if line.startswith('flags'):
+                return line.split(':', 1)[1].split()
+    return []
+
+
+# The manifest itself, the output of docker inspect or the labels of the image
+# (e.g. singularity inspect --json)
+def load_manifest(path):
+    if path == '-':
+        data = json.load(sys.stdin)
+    else:
+        with open(path) as f:
+            data = json.load(f)
+
+    if isinstance(data, list):
+        data = data[0]['Config']['Labels']
+    if 'engines' not in data:
+        labels = data.get('data', {}).get('attributes', {}).get('labels', data)
+        data = json.loads(labels[config.ENGINE_MANIFEST_LABEL].strip("'"))
+    return data
+
+
+# Best SIMD instruction set of the node, as named by the engines
+def get_node_simd(flags):
+    for architecture in config.ARCHITECTURES:
+        if config.SIMD_CPU_FLAGS[architecture] in flags:
+            return config.SIMD_MAPPER[architecture]
+    return None
+
+
+# The engine run by the chooser for the wrapper: the best SIMD instruction set
+# supported by the node, rdtscp engines first
+def select_engine(manifest, flags, wrapper):
+    ranks = {simd: rank for rank, simd in enumerate(config.GMX_BINARY_DIRECTORY_SUFFIX)}
+    candidates = [engine for engine in manifest['engines']
+                  if engine['wrapper'] == wrapper and all(flag in flags for flag in engine['cpu_flags'])]
+    candidates.sort(key=lambda engine: (ranks[engine['simd']], engine['rdtscp'] != 'on'))
+    return candidates[0] if candidates else None
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Match the GROMACS engines of an image against cpu flags.')
+    parser.add_argument('--manifest', default=config.ENGINE_MANIFEST_FILE,
+                        help=('Engine manifest, docker inspect output or image labels, - for stdin '
+                              '(DEFAULT: {0}).'.format(config.ENGINE_MANIFEST_FILE)))
+    flags_group = parser.add_mutually_exclusive_group()
+    flags_group.add_argument('--cpuinfo', default='/proc/cpuinfo',
+                             help='cpuinfo of the node (DEFAULT: /proc/cpuinfo).')
+    flags_group.add_argument('--flags', nargs='+', help='cpu flags of the node, as listed in /proc/cpuinfo.')
+    parser.add_argument('--wrapper', nargs='+', help='Wrappers to match (DEFAULT: all wrappers of the image).')
+    parser.add_argument('--strict', action='store_true',
+                        help='Fail if the node would not run an engine of its best SIMD instruction set.')
+    args = parser.parse_args()
+
+    manifest = load_manifest(args.manifest)
+    flags = set(args.flags if args.flags else get_cpu_flags(args.cpuinfo))
+    node_simd = get_node_simd(flags)
+
+    report = {
+        'node': {'simd': node_simd, 'rdtscp': config.RDTSCP_CPU_FLAG in flags},
+        'wrappers': {}
+    }
+    placeable = True
+    for wrapper in args.wrapper or manifest['wrappers']:
+        engine = select_engine(manifest, flags, wrapper)
+        optimal = engine is not None and engine['simd'] == node_simd
+        report['wrappers'][wrapper] = {'engine': engine, 'optimal': optimal}
+        if engine is None or (args.strict and not optimal):
+            placeable = False
+    report['placeable'] = placeable
+
+    print(json.dumps(report, indent=2))
+    sys.exit(0 if placeable else 1)
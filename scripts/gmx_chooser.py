@@ -10,7 +10,9 @@ Usage:
 
 import sys
 import os
+import json
 import config
+import tpr
 
 
 RDTSCP = 'rdtscp'
@@ -26,49 +28,146 @@ def is_executable(file):
     return False
 
 
+# Candidate binaries for a wrapper, in order of preference. The wrapper name already
+# carries the mpi and double precision suffixes, e.g. gmx_mpi_d only matches the
+# double precision engines. rdtscp binaries are preferred when the cpu supports it
+def get_binary_candidates(flags, wrapper):
+    candidates = [wrapper]
+    if RDTSCP in flags:
+        candidates.insert(0, wrapper + config.GMX_ENGINE_SUFFIX_OPTIONS[RDTSCP])
+    return candidates
+
+
 # Choose the best possible GROMACS based on cpu's SIMD instruction
-def get_binary_directory(flags, gmx):
+def get_binary_directory(flags, candidates):
     for (arch, bin_suffix) in zip(config.ARCHITECTURES, config.GMX_BINARY_DIRECTORY_SUFFIX):
         bin_dir = config.GMX_BINARY_DIRECTORY.format(bin_suffix)
-        if arch in flags and os.path.exists(bin_dir):
+        if config.SIMD_CPU_FLAGS[arch] in flags and os.path.exists(bin_dir):
             fileshere = os.listdir(bin_dir)
-            try:
-                idx = fileshere.index(gmx)
-            except ValueError:
-                continue
-            else:
-                file = fileshere[idx]
-                if is_executable(os.path.join(bin_dir, file)):
-                    return bin_dir
-                else:
-                    continue
-    return None
+            for gmx in candidates:
+                if gmx in fileshere and is_executable(os.path.join(bin_dir, gmx)):
+                    return (bin_dir, gmx)
+    return (None, None)
+
+
+# Preloading the memory allocator of the image for the engine, unless GMX_ALLOCATOR=glibc
+def preload_allocator():
+    allocator = os.environ.get(config.ALLOCATOR_VARIABLE, 'glibc')
+    if allocator not in config.ALLOCATOR_LIBRARIES:
+        return
+    library = os.path.join(config.ALLOCATOR_DIRECTORY, 'lib', config.ALLOCATOR_LIBRARIES[allocator])
+    if not os.path.isfile(library):
+        print('Warning: {variable}={allocator} but {library} is missing, running with the glibc allocator'.format(
+            variable=config.ALLOCATOR_VARIABLE, allocator=allocator, library=library), file=sys.stderr)
+        return
+    preload = os.environ.get('LD_PRELOAD', '')
+    os.environ['LD_PRELOAD'] = library + (':' + preload if preload else '')
+
+
+# Run input file of mdrun (-s, <deffnm>.tpr with -deffnm, topol.tpr by default), None for other commands
+def get_tpr_path(args):
+    if not args or args[0] != 'mdrun':
+        return None
+    if '-s' in args[:-1]:
+        return args[args.index('-s') + 1]
+    if '-deffnm' in args[:-1]:
+        return args[args.index('-deffnm') + 1] + '.tpr'
+    return config.MDRUN_DEFAULT_INPUTS['-s']
+
+
+# Header of the run input file, None if not readable
+def get_tpr_header(path):
+    if path is None or not os.path.isfile(path):
+        return None
+    try:
+        return tpr.read_header(path)
+    except (RuntimeError, ValueError, OSError) as error:
+        print('Could not read the header of {0}: {1}'.format(path, error))
+        return None
+
+
+# Refusing tpr files written by a newer GROMACS than the engines of the image,
+# before mdrun is started (e.g. on all the MPI ranks)
+def check_tpr_version(header, path):
+    version = os.environ.get(config.GMX_VERSION_VARIABLE, '')
+    supported = config.GMX_TPX_VERSIONS.get(version.split('.')[0], None)
+    if supported is not None and header['file_version'] > supported:
+        print('{0} was written by GROMACS {1} (tpr version {2}), the engines of this image (GROMACS {3}) '
+              'read tpr versions up to {4}. Exiting...'.format(
+                  path, header['generator_version'], header['file_version'], version, supported))
+        os._exit(-1)
+
+
+# Double precision tpr files are run with the double precision engine of the
+# wrapper when the image has one, whatever its SIMD instruction set
+def get_double_candidates(flags, wrapper):
+    double = config.GMX_ENGINE_SUFFIX_OPTIONS['double']
+    if wrapper.endswith(double):
+        return []
+    return get_binary_candidates(flags, wrapper + double)
+
+
+# Whether the engine was built with thread-MPI, as recorded in the engine manifest.
+# Engines missing from the manifest are taken as built with an MPI library
+def is_thread_mpi(binary_directory, gmx):
+    try:
+        with open(config.ENGINE_MANIFEST_FILE) as f:
+            engines = json.load(f)['engines']
+    except (OSError, ValueError, KeyError):
+        return False
+    for engine in engines:
+        if engine['directory'] == binary_directory and engine['binary'] == gmx:
+            return engine.get('thread_mpi', False)
+    return False
+
+
+# Default thread count of thread-MPI engines for small systems, so that every
+# thread gets at least TPR_ATOMS_PER_THREAD atoms. Explicit settings are kept.
+# Engines built with an MPI library refuse -nt
+def get_thread_args(header, thread_mpi, args):
+    if not thread_mpi or 'OMP_NUM_THREADS' in os.environ:
+        return []
+    if any(option in args for option in ['-nt', '-ntmpi', '-ntomp', '-multidir']):
+        return []
+    cpus = len(os.sched_getaffinity(0))
+    threads = max(1, header['natoms'] // config.TPR_ATOMS_PER_THREAD)
+    return ['-nt', str(threads)] if threads < cpus else []
 
 
 def run(binary_directory, gmx, args):
     binary_path = os.path.join(binary_directory, gmx)
-    os.system(binary_path + ' ' + ' '.join(args))
+    preload_allocator()
+    # replacing the chooser, so that signals and the exit code go to/from the engine
+    os.execv(binary_path, [binary_path] + args)
 
 
 if __name__ == '__main__':
     sys.argv[1] = os.path.split(sys.argv[1])[1]
 
     pipe = os.popen('cat /proc/cpuinfo | grep ^flags | head -1')
-    flags = pipe.read()
-
-    rdtscp_enabled = True if RDTSCP in flags else False
+    flags = pipe.read().split()
 
-    gmx = sys.argv[1]
+    wrapper = sys.argv[1]
     args = sys.argv[2:] if len(sys.argv) > 2 else []
 
-    if rdtscp_enabled:
-        gmx += config.GMX_ENGINE_SUFFIX_OPTIONS[RDTSCP]
+    gmx_binary_directory, gmx = (None, None)
 
-    gmx_binary_directory = get_binary_directory(flags, gmx)
+    tpr_path = get_tpr_path(args)
+    header = get_tpr_header(tpr_path)
+    if header is not None:
+        check_tpr_version(header, tpr_path)
+        if header['double']:
+            gmx_binary_directory, gmx = get_binary_directory(flags, get_double_candidates(flags, wrapper))
+
+    if not gmx_binary_directory:
+        gmx_binary_directory, gmx = get_binary_directory(flags, get_binary_candidates(flags, wrapper))
 
     if not gmx_binary_directory:
         print('No appropriate GROMACS installaiton available. Exiting...')
         os._exit(-1)
 
+    if header is not None:
+        args += get_thread_args(header, is_thread_mpi(gmx_binary_directory, gmx), args)
+
     # running the binary
     run(binary_directory=gmx_binary_directory, gmx=gmx, args=args)
@@ -0,0 +1,84 @@
+#!/usr/bin/env python3
+
+'''
+Author :
+    * Muhammed Ahad <ahad3112@yahoo.com, maaahad@gmail.com>
+
+Usage:
+    $ python3 regtest.py -h/--help
+Description:
+    Runs the GROMACS regression tests of one engine in parallel with ctest and
+    writes pass/fail and timing to a json report. Engines that can not be executed
+    on the build host are skipped, and the reason is recorded in the report. Exits
+    with 1 when the tests fail, unless --allow-failures is given.
+'''
+
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+import config
+
+
+def get_cpu_flags():
+    with open('/proc/cpuinfo') as cpuinfo:
+        for line in cpuinfo:
+            if line.startswith('flags'):
+                return line.split(':', 1)[1].split()
+    return []
+
+
+# cpu flags required by the engine and missing on this host
+def get_missing_flags(flags, simd, rdtscp):
+    architecture = dict(zip(config.GMX_BINARY_DIRECTORY_SUFFIX, config.ARCHITECTURES))[simd]
+    required = [config.SIMD_CPU_FLAGS[architecture]]
+    if rdtscp == 'on':
+        required.append(config.RDTSCP_CPU_FLAG)
+    return [flag for flag in required if flag not in flags]
+
+
+def run(build_directory, jobs):
+    start = time.time()
+    returncode = subprocess.call(['ctest', '-j', str(jobs), '--output-on-failure'], cwd=build_directory)
+    return (returncode, time.time() - start)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run GROMACS regression tests for one engine.')
+    parser.add_argument('--build-directory', required=True, help='GROMACS build directory of the engine.')
+    parser.add_argument('--simd', required=True, choices=config.GMX_BINARY_DIRECTORY_SUFFIX)
+    parser.add_argument('--rdtscp', required=True, choices=config.ENGINE_OPTIONS['rdtscp'])
+    parser.add_argument('--precision', required=True, choices=config.ENGINE_OPTIONS['precision'])
+    parser.add_argument('--jobs', type=int, default=os.cpu_count(), help='Number of tests to run in parallel.')
+    parser.add_argument('--report', required=True, help='json report to be written.')
+    parser.add_argument('--allow-failures', action='store_true', help='Exit with 0 when the tests fail.')
+    args = parser.parse_args()
+
+    report = {
+        'simd': args.simd,
+        'rdtscp': args.rdtscp,
+        'precision': args.precision,
+        'jobs': args.jobs
+    }
+
+    missing_flags = get_missing_flags(get_cpu_flags(), args.simd, args.rdtscp)
+    if missing_flags:
+        report['status'] = 'skipped'
+        report['reason'] = 'build host lacks cpu flags: ' + ', '.join(missing_flags)
+    else:
+        returncode, seconds = run(args.build_directory, args.jobs)
+        report['status'] = 'passed' if returncode == 0 else 'failed'
+        report['returncode'] = returncode
+        report['seconds'] = round(seconds, 1)
+
+    os.makedirs(os.path.dirname(args.report), exist_ok=True)
+    with open(args.report, 'w') as f:
+        json.dump(report, f, indent=2)
+
+    print('Regression tests {status}: {report}'.format(status=report['status'], report=args.report))
+
+    # failing tests fail the stage, and so the image build. Skipped engines don't
+    if report['status'] == 'failed' and not args.allow_failures:
+        sys.exit(1)
@@ -0,0 +1,255 @@
+#!/usr/bin/env python3
+
+'''
+Author :
+    * Muhammed Ahad <ahad3112@yahoo.com, maaahad@gmail.com>
+
+Usage:
+    $ GMX_STAGE_DIR=$TMPDIR gmx_mpi mdrun -s topol.tpr ...
+
+Node-local scratch staging for mdrun, used by the wrapper. The first rank of every
+node copies the run inputs to GMX_STAGE_DIR, all ranks of the node run mdrun there,
+and the first rank syncs the outputs back to the working directory every
+GMX_STAGE_SYNC_INTERVAL seconds, when mdrun exits and when the job is terminated.
+'''
+
+import os
+import re
+import sys
+import glob
+import time
+import shutil
+import signal
+import hashlib
+import threading
+import subprocess
+import config
+
+
+READY = '.ready'
+
+
+# Rank of the process within the node, 0 when not started by an MPI launcher
+def get_local_rank():
+    for variable in config.LOCAL_RANK_VARIABLES:
+        if variable in os.environ:
+            return int(os.environ[variable])
+    return 0
+
+
+# Stage directory shared by all the ranks of one mdrun launch running on a node. Launches
+# running at the same time within a job (e.g. Slurm steps) get a directory of their own
+def get_stage_directory(base):
+    for variable in config.JOB_ID_VARIABLES:
+        if os.environ.get(variable):
+            job = os.environ[variable]
+            break
+    else:
+        job = hashlib.md5(os.getcwd().encode()).hexdigest()[:12]
+
+    for variable in config.LAUNCH_ID_VARIABLES:
+        if os.environ.get(variable):
+            launch = os.environ[variable]
+            break
+    else:
+        # without MPI launcher, the wrapper is the only process using the directory
+        launch = '' if any(variable in os.environ for variable in config.LOCAL_RANK_VARIABLES) else str(os.getpid())
+
+    name = 'gmx-stage-' + job + ('-' + launch if launch else '')
+    return os.path.join(os.path.expandvars(base), re.sub(r'[^A-Za-z0-9._-]', '_', name))
+
+
+# Paths that are absolute or leave the working directory can't be mirrored in the stage directory
+def is_outside(path):
+    path = os.path.normpath(path)
+    return os.path.isabs(path) or path == os.pardir or path.startswith(os.pardir + os.sep)
+
+
+# Files to copy to the stage directory (relative to it) and the mdrun arguments
+# pointing to them. Input paths outside the working directory are staged under their
+# basename, output paths outside of it are made absolute so that they are written in place
+def get_staged_files(args):
+    files = {}
+    args = list(args)
+    given = set()
+    deffnm = get_value(args, '-deffnm')
+    # mdrun restarts from the default checkpoint when -cpi is given without a file
+    checkpoint = None
+    if '-cpi' in args:
+        checkpoint = get_value(args, '-cpi') or (deffnm + '.cpt' if deffnm else config.MDRUN_DEFAULT_CHECKPOINT)
+
+    for i, option in enumerate(args[:-1]):
+        value = args[i + 1]
+        if value.startswith('-'):
+            continue
+        if option == '-deffnm':
+            if is_outside(value):
+                args[i + 1] = os.path.abspath(value)
+                continue
+            for path in glob.glob(value + '.*'):
+                files[path] = path
+        elif option in config.MDRUN_INPUT_OPTIONS or option in config.MDRUN_OUTPUT_OPTIONS:
+            given.add(option)
+            if is_outside(value):
+                if option in config.MDRUN_INPUT_OPTIONS and os.path.isfile(value):
+                    files[os.path.basename(value)] = value
+                    args[i + 1] = os.path.basename(value)
+                else:
+                    args[i + 1] = os.path.abspath(value)
+            elif os.path.isfile(value):
+                files[value] = value
+
+    defaults = dict(config.MDRUN_DEFAULT_INPUTS)
+    # outputs appended to (or continued in new parts) when restarting, -deffnm outputs are staged above
+    if checkpoint is not None and deffnm is None:
+        defaults.update(config.MDRUN_DEFAULT_OUTPUTS)
+        defaults['-cpi'] = checkpoint
+    for option, default in defaults.items():
+        if option not in given and not is_outside(default) and os.path.isfile(default):
+            files[default] = default
+
+    return files, args
+
+
+# Value of an mdrun option, None if the option is not given or given without value
+def get_value(args, option):
+    if option not in args[:-1]:
+        return None
+    value = args[args.index(option) + 1]
+    return None if value.startswith('-') else value
+
+
+def copy_inputs(files, stage_directory):
+    shutil.rmtree(stage_directory, ignore_errors=True)
+    os.makedirs(stage_directory)
+    for relative, source in files.items():
+        target = os.path.join(stage_directory, relative)
+        os.makedirs(os.path.dirname(target), exist_ok=True)
+        shutil.copy2(source, target)
+    # all the other ranks of the node wait for this file before starting
+    with open(os.path.join(stage_directory, READY), 'w'):
+        pass
+
+
+def wait_inputs(stage_directory):
+    deadline = time.time() + config.STAGE_READY_TIMEOUT
+    while not os.path.isfile(os.path.join(stage_directory, READY)):
+        if time.time() > deadline:
+            raise SystemExit('Stage directory {0} not ready after {1} seconds. Exiting...'.format(
+                stage_directory, config.STAGE_READY_TIMEOUT))
+        time.sleep(0.5)
+
+
+# Backing up an existing file as #name.N#, as GROMACS does before writing a new output.
+# Returns False if the file must not be overwritten
+def backup(path):
+    maxbackup = int(os.environ.get(config.MAXBACKUP_VARIABLE, config.DEFAULT_MAXBACKUP))
+    if maxbackup < 0:
+        return True
+    directory, name = os.path.split(path)
+    for count in range(1, maxbackup + 1):
+        backup_path = os.path.join(directory, '#{0}.{1}#'.format(name, count))
+        if not os.path.exists(backup_path):
+            os.rename(path, backup_path)
+            print('Back Off! I just backed up {0} to {1}'.format(path, backup_path), file=sys.stderr)
+            return True
+    print('Not overwriting {0}, no backup of it can be made ({1}={2})'.format(
+        path, config.MAXBACKUP_VARIABLE, maxbackup), file=sys.stderr)
+    return False
+
+
+# Copying back the files created or modified since the last sync. Files are copied
+# under a temporary name and renamed, so that a partial copy never replaces an output.
+# Files of the working directory that were not staged are backed up before being
+# replaced for the first time. Returns the files that could not be copied back
+def sync_outputs(stage_directory, destination, synced):
+    refused = []
+    for root, _, files in os.walk(stage_directory):
+        for name in files:
+            source = os.path.join(root, name)
+            relative = os.path.relpath(source, stage_directory)
+            if relative == READY:
+                continue
+            try:
+                stat = os.stat(source)
+            except FileNotFoundError:
+                # mdrun renames its checkpoint files while writing them
+                continue
+            if synced.get(relative) == (stat.st_mtime, stat.st_size):
+                continue
+            target = os.path.join(destination, relative)
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            try:
+                shutil.copy2(source, target + '.staging')
+            except FileNotFoundError:
+                continue
+            if relative not in synced and os.path.exists(target) and not backup(target):
+                os.remove(target + '.staging')
+                refused.append(relative)
+                continue
+            os.replace(target + '.staging', target)
+            synced[relative] = (stat.st_mtime, stat.st_size)
+    return refused
+
+
+def get_synced(stage_directory):
+    synced = {}
+    for root, _, files in os.walk(stage_directory):
+        for name in files:
+            source = os.path.join(root, name)
+            stat = os.stat(source)
+            synced[os.path.relpath(source, stage_directory)] = (stat.st_mtime, stat.st_size)
+    return synced
+
+
+# Syncing the outputs in the background until stopped
+def start_syncer(stage_directory, destination, synced, interval):
+    stop = threading.Event()
+
+    def sync():
+        while not stop.wait(interval):
+            sync_outputs(stage_directory, destination, synced)
+
+    thread = threading.Thread(target=sync, daemon=True)
+    thread.start()
+    return stop, thread
+
+
+# Running the command within the stage directory, returns its exit code
+def run(command, args):
+    base = os.environ[config.STAGE_DIRECTORY_VARIABLE]
+    interval = float(os.environ.get(config.STAGE_SYNC_INTERVAL_VARIABLE, config.DEFAULT_STAGE_SYNC_INTERVAL))
+    stage_directory = get_stage_directory(base)
+    destination = os.getcwd()
+    first = get_local_rank() == 0
+
+    files, args = get_staged_files(args)
+    if first:
+        copy_inputs(files, stage_directory)
+        synced = get_synced(stage_directory)
+        stop, thread = start_syncer(stage_directory, destination, synced, interval)
+    else:
+        wait_inputs(stage_directory)
+
+    child = subprocess.Popen(command + args, cwd=stage_directory)
+
+    # the scheduler (or docker stop) may only signal the wrapper: mdrun is asked to
+    # write a checkpoint and stop, the outputs are synced back once it has exited
+    def terminate(signum, frame):
+        child.send_signal(signum)
+    signal.signal(signal.SIGTERM, terminate)
+
+    returncode = child.wait()
+
+    if first:
+        stop.set()
+        thread.join()
+        refused = sync_outputs(stage_directory, destination, synced)
+        if refused:
+            # keeping the outputs that could not be copied back
+            print('Outputs not copied back are kept in {0}: {1}'.format(stage_directory, ', '.join(refused)),
+                  file=sys.stderr)
+        else:
+            shutil.rmtree(stage_directory, ignore_errors=True)
+
+    return returncode
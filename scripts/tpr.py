@@ -0,0 +1,118 @@
+#!/usr/bin/env python3
+
+'''
+Author :
+    * Muhammed Ahad <ahad3112@yahoo.com, maaahad@gmail.com>
+
+Usage:
+    $ tpr.py topol.tpr
+
+Reading the header of a GROMACS run input (.tpr) file without reading its body.
+The file is memory mapped, so that only the pages holding the header are read
+from disk. The header is XDR encoded (big endian), as written by do_tpxheader().
+'''
+
+import sys
+import json
+import mmap
+import struct
+import config
+
+
+# tpr file version adding the size of the body to the header
+TPXV_ADD_SIZE_FIELD = 119
+
+
+class TprReader:
+    '''
+    Sequential reader of XDR values from a memory mapped tpr file
+    '''
+    def __init__(self, buffer):
+        self.buffer = buffer
+        self.offset = 0
+
+    def __unpack(self, fmt, size):
+        if self.offset + size > len(self.buffer):
+            raise RuntimeError('Truncated tpr header')
+        value, = struct.unpack_from(fmt, self.buffer, self.offset)
+        self.offset += size
+        return value
+
+    def int(self):
+        return self.__unpack('>i', 4)
+
+    def int64(self):
+        return self.__unpack('>q', 8)
+
+    def real(self, precision):
+        return self.__unpack('>d' if precision == 8 else '>f', precision)
+
+    def string(self):
+        # GROMACS writes the size including the terminating null, then the xdr string
+        self.int()
+        length = self.int()
+        if length < 0 or length > 1024:
+            raise RuntimeError('Not a tpr file')
+        value = bytes(self.buffer[self.offset:self.offset + length])
+        self.offset += (length + 3) // 4 * 4
+        return value.rstrip(b'\0').decode('ascii', errors='replace')
+
+
+def read_header(path):
+    '''
+    Returns the header of the tpr file as a dictionary
+    '''
+    with open(path, 'rb') as tpr:
+        with mmap.mmap(tpr.fileno(), 0, access=mmap.ACCESS_READ) as buffer:
+            return parse_header(TprReader(buffer))
+
+
+def parse_header(reader):
+    header = {}
+
+    generator = reader.string()
+    if not generator.startswith('VERSION '):
+        raise RuntimeError('Not a tpr file')
+    header['generator'] = generator
+    header['generator_version'] = generator[len('VERSION '):]
+
+    precision = reader.int()
+    if precision not in [4, 8]:
+        raise RuntimeError('Unknown tpr precision: {0} bytes'.format(precision))
+    header['precision'] = precision
+    header['double'] = precision == 8
+
+    version = reader.int()
+    if version < config.TPX_MIN_VERSION:
+        raise RuntimeError('tpr file version {0} is not supported'.format(version))
+    header['file_version'] = version
+    header['file_tag'] = None
+    # development versions 77-79 wrote the tag before the generation
+    if 77 <= version <= 79:
+        header['file_tag'] = reader.string()
+    header['file_generation'] = reader.int()
+    if version >= 81:
+        header['file_tag'] = reader.string()
+
+    header['natoms'] = reader.int()
+    header['ngtc'] = reader.int()
+    if version < 62:
+        reader.int()
+        reader.real(precision)
+    header['fep_state'] = reader.int() if version >= 79 else 0
+    header['lambda'] = reader.real(precision)
+    for key in ['has_ir', 'has_topology', 'has_coordinates', 'has_velocities', 'has_forces', 'has_box']:
+        header[key] = reader.int() != 0
+
+    header['body_size'] = None
+    if version >= TPXV_ADD_SIZE_FIELD and header['file_generation'] >= 27:
+        header['body_size'] = reader.int64()
+
+    return header
+
+
+if __name__ == '__main__':
+    if len(sys.argv) != 2:
+        raise SystemExit('Usage: tpr.py <tpr file>')
+
+    print(json.dumps(read_header(sys.argv[1]), indent=4))
@@ -10,5 +10,12 @@ Usage:
 
 import sys
 import os
+import config
+
+
+# Running mdrun from node-local scratch when GMX_STAGE_DIR is set
+if len(sys.argv) > 1 and sys.argv[1] == 'mdrun' and os.environ.get(config.STAGE_DIRECTORY_VARIABLE):
+    import scratch
+    sys.exit(scratch.run(['gmx_chooser.py', sys.argv[0], 'mdrun'], sys.argv[2:]))
 
 os.system('gmx_chooser.py ' + ' '.join(sys.argv))
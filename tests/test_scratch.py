@@ -0,0 +1,144 @@
+'''
+Author :
+    * Muhammed Ahad <ahad3112@yahoo.com, maaahad@gmail.com>
+
+Tests of the node-local scratch staging of mdrun's inputs and outputs.
+'''
+
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'scripts'), ROOT]
+
+import scratch
+
+
+def touch(path, content='x'):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w') as f:
+        f.write(content)
+
+
+def read(path):
+    with open(path) as f:
+        return f.read()
+
+
+class StagedFilesTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cwd = os.getcwd()
+        self.directory = tempfile.TemporaryDirectory()
+        os.makedirs(os.path.join(self.directory.name, 'work'))
+        os.chdir(os.path.join(self.directory.name, 'work'))
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.directory.cleanup()
+
+    def test_fresh_run(self):
+        for name in ['topol.tpr', 'md.log', 'state.cpt']:
+            touch(name)
+        files, args = scratch.get_staged_files(['-s', 'topol.tpr'])
+        self.assertEqual(files, {'topol.tpr': 'topol.tpr'})
+        self.assertEqual(args, ['-s', 'topol.tpr'])
+
+    def test_restart(self):
+        for name in ['topol.tpr', 'state.cpt', 'md.log', 'ener.edr', 'traj_comp.xtc', 'traj.trr', 'run.log']:
+            touch(name)
+        files, _ = scratch.get_staged_files(['-s', 'topol.tpr', '-cpi', 'state.cpt', '-g', 'run.log'])
+        # outputs under their default names, except those given explicitly
+        self.assertEqual(sorted(files), ['ener.edr', 'run.log', 'state.cpt', 'topol.tpr', 'traj.trr', 'traj_comp.xtc'])
+
+    def test_bare_cpi(self):
+        for name in ['topol.tpr', 'state.cpt', 'md.log']:
+            touch(name)
+        for args in [['-s', 'topol.tpr', '-cpi'], ['-cpi', '-s', 'topol.tpr']]:
+            files, staged_args = scratch.get_staged_files(args)
+            self.assertEqual(sorted(files), ['md.log', 'state.cpt', 'topol.tpr'])
+            self.assertEqual(staged_args, args)
+
+    def test_bare_cpi_without_checkpoint(self):
+        touch('topol.tpr')
+        files, _ = scratch.get_staged_files(['-s', 'topol.tpr', '-cpi'])
+        self.assertEqual(files, {'topol.tpr': 'topol.tpr'})
+
+    def test_deffnm(self):
+        for name in ['md.tpr', 'md.cpt', 'md.log', 'md.edr', 'other.log']:
+            touch(name)
+        files, args = scratch.get_staged_files(['-deffnm', 'md', '-cpi'])
+        self.assertEqual(sorted(files), ['md.cpt', 'md.edr', 'md.log', 'md.tpr'])
+        self.assertEqual(args, ['-deffnm', 'md', '-cpi'])
+
+    def test_outside(self):
+        touch('../input/run.tpr')
+        touch('../input/run.cpt')
+        files, args = scratch.get_staged_files(['-s', '../input/run.tpr', '-cpi', '../input/run.cpt',
+                                                '-o', '../out/traj.trr', '-deffnm', '../run/md'])
+        self.assertEqual(files, {'run.tpr': '../input/run.tpr', 'run.cpt': '../input/run.cpt'})
+        self.assertEqual(args, ['-s', 'run.tpr', '-cpi', 'run.cpt',
+                                '-o', os.path.abspath('../out/traj.trr'), '-deffnm', os.path.abspath('../run/md')])
+
+
+class SyncOutputsTest(unittest.TestCase):
+
+    def setUp(self):
+        self.directory = tempfile.TemporaryDirectory()
+        self.stage = os.path.join(self.directory.name, 'stage')
+        self.destination = os.path.join(self.directory.name, 'work')
+        os.makedirs(self.stage)
+        os.makedirs(self.destination)
+
+    def tearDown(self):
+        self.directory.cleanup()
+
+    def sync(self, synced, maxbackup=None):
+        environment = {scratch.config.MAXBACKUP_VARIABLE: str(maxbackup)} if maxbackup is not None else {}
+        with mock.patch.dict(os.environ, environment), mock.patch('sys.stderr'):
+            return scratch.sync_outputs(self.stage, self.destination, synced)
+
+    def test_new_and_modified_files(self):
+        touch(os.path.join(self.stage, 'md.log'), 'staged')
+        touch(os.path.join(self.destination, 'md.log'), 'staged')
+        synced = scratch.get_synced(self.stage)
+        touch(os.path.join(self.stage, 'md.log'), 'staged and appended')
+        touch(os.path.join(self.stage, 'ener.edr'), 'new')
+        self.assertEqual(self.sync(synced), [])
+        # staged files are appended to, not backed up
+        self.assertEqual(sorted(os.listdir(self.destination)), ['ener.edr', 'md.log'])
+        self.assertEqual(read(os.path.join(self.destination, 'md.log')), 'staged and appended')
+        self.assertEqual(read(os.path.join(self.destination, 'ener.edr')), 'new')
+
+    def test_backup(self):
+        touch(os.path.join(self.destination, 'md.log'), 'previous run')
+        touch(os.path.join(self.destination, '#md.log.1#'), 'run before')
+        synced = scratch.get_synced(self.stage)
+        touch(os.path.join(self.stage, 'md.log'), 'first sync')
+        self.sync(synced)
+        self.assertEqual(read(os.path.join(self.destination, '#md.log.1#')), 'run before')
+        self.assertEqual(read(os.path.join(self.destination, '#md.log.2#')), 'previous run')
+        self.assertEqual(read(os.path.join(self.destination, 'md.log')), 'first sync')
+        # the file written by this run is replaced on the next syncs
+        touch(os.path.join(self.stage, 'md.log'), 'second sync')
+        os.utime(os.path.join(self.stage, 'md.log'), (0, 0))
+        self.sync(synced)
+        self.assertEqual(sorted(os.listdir(self.destination)), ['#md.log.1#', '#md.log.2#', 'md.log'])
+        self.assertEqual(read(os.path.join(self.destination, 'md.log')), 'second sync')
+
+    def test_no_backup(self):
+        touch(os.path.join(self.destination, 'md.log'), 'previous run')
+        touch(os.path.join(self.stage, 'md.log'), 'new run')
+        self.assertEqual(self.sync({}, maxbackup=0), ['md.log'])
+        self.assertEqual(os.listdir(self.destination), ['md.log'])
+        self.assertEqual(read(os.path.join(self.destination, 'md.log')), 'previous run')
+        self.assertEqual(self.sync({}, maxbackup=-1), [])
+        self.assertEqual(os.listdir(self.destination), ['md.log'])
+        self.assertEqual(read(os.path.join(self.destination, 'md.log')), 'new run')
+
+
+if __name__ == '__main__':
+    unittest.main()
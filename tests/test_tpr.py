@@ -0,0 +1,80 @@
+'''
+Author :
+    * Muhammed Ahad <ahad3112@yahoo.com, maaahad@gmail.com>
+
+Tests of the tpr header reader and of the chooser's use of it.
+'''
+
+import os
+import sys
+import tempfile
+import unittest
+from unittest import mock
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [os.path.join(ROOT, 'scripts'), ROOT]
+
+import tpr
+import gmx_chooser
+
+
+TPR_FILE = os.path.join(ROOT, 'tpr_file', 'topol-gromacs-2020.1.tpr')
+
+
+class TprHeaderTest(unittest.TestCase):
+
+    def test_bundled_tpr(self):
+        header = tpr.read_header(TPR_FILE)
+        self.assertEqual(header['generator_version'], '2020.1')
+        self.assertEqual(header['file_version'], 119)
+        self.assertEqual(header['file_generation'], 27)
+        self.assertEqual(header['file_tag'], 'release')
+        self.assertEqual(header['natoms'], 18330)
+        self.assertEqual(header['precision'], 4)
+        self.assertIs(header['double'], False)
+        self.assertEqual(header['body_size'], 1028526)
+
+    def test_empty_file(self):
+        with tempfile.NamedTemporaryFile(suffix='.tpr') as empty:
+            with self.assertRaises(ValueError):
+                tpr.read_header(empty.name)
+
+    def test_not_a_tpr_file(self):
+        with tempfile.NamedTemporaryFile(suffix='.tpr') as other:
+            other.write(b'not a tpr file, but long enough to hold a header')
+            other.flush()
+            with self.assertRaises(RuntimeError):
+                tpr.read_header(other.name)
+
+    def test_truncated_header(self):
+        with open(TPR_FILE, 'rb') as f:
+            data = f.read(64)
+        with tempfile.NamedTemporaryFile(suffix='.tpr') as truncated:
+            truncated.write(data)
+            truncated.flush()
+            with self.assertRaises(RuntimeError):
+                tpr.read_header(truncated.name)
+
+
+class ChooserTprTest(unittest.TestCase):
+
+    def test_tpr_path(self):
+        self.assertEqual(gmx_chooser.get_tpr_path(['mdrun', '-s', 'run.tpr', '-deffnm', 'md']), 'run.tpr')
+        self.assertEqual(gmx_chooser.get_tpr_path(['mdrun', '-deffnm', 'md']), 'md.tpr')
+        self.assertEqual(gmx_chooser.get_tpr_path(['mdrun']), 'topol.tpr')
+        self.assertIsNone(gmx_chooser.get_tpr_path(['grompp', '-f', 'md.mdp']))
+
+    def test_thread_args(self):
+        header = tpr.read_header(TPR_FILE)
+        # engines built with an MPI library refuse -nt
+        self.assertEqual(gmx_chooser.get_thread_args(header, False, ['mdrun']), [])
+        self.assertEqual(gmx_chooser.get_thread_args(header, True, ['mdrun', '-ntomp', '2']), [])
+        environment = {key: value for key, value in os.environ.items() if key != 'OMP_NUM_THREADS'}
+        with mock.patch.dict(os.environ, environment, clear=True), \
+             mock.patch('os.sched_getaffinity', return_value=set(range(128))):
+            # 18330 atoms, one thread per 500 atoms
+            self.assertEqual(gmx_chooser.get_thread_args(header, True, ['mdrun']), ['-nt', '36'])
+
+
+if __name__ == '__main__':
+    unittest.main()
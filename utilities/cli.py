@@ -47,7 +47,8 @@ class CLI:
                                  help='GCC version (DEFAULT: {0}).'.format(config.DEFAULT_GCC_VERSION))
 
         self.parser.add_argument('--double', action='store_true',
-                                 help='ENABLE DOUBLE precision (!!!NOT TESTED YET!!!).')
+                                 help=('ENABLE DOUBLE precision (!!!NOT TESTED YET!!!). '
+                                       'For gmx, this is the default precision of engines without precision key.'))
 
         self.__set_linux_distribution()
 
@@ -88,6 +89,28 @@ class FftwCLI(CLI):
                                        'Multiple option can be chosen separated by space.')
                                  )
 
+        self.__set_fftw_wisdom_options()
+
+    def __set_fftw_wisdom_options(self):
+        '''
+        User can ask for FFTW wisdom to be generated at build time for a list of
+        3-D real-to-complex transform sizes and thread counts. The wisdom is installed
+        as FFTW's system wisdom, only used by applications calling fftw_import_system_wisdom()
+        '''
+        self.parser.add_argument('--fftw-wisdom', type=str,
+                                 metavar='NXxNYxNZ',
+                                 nargs='*',
+                                 help=('ENABLE FFTW system wisdom generation for the given transform sizes. '
+                                       'Multiple sizes can be chosen separated by space '
+                                       '(DEFAULT: {0}).'.format(' '.join(config.DEFAULT_FFTW_WISDOM_SIZES))))
+
+        self.parser.add_argument('--fftw-wisdom-threads', type=int,
+                                 metavar='N',
+                                 nargs='+',
+                                 default=config.DEFAULT_FFTW_WISDOM_THREADS,
+                                 help=('Thread counts to generate FFTW wisdom for '
+                                       '(DEFAULT: {0}).'.format(' '.join(map(str, config.DEFAULT_FFTW_WISDOM_THREADS)))))
+
 class GromacsCLI(CLI):
     '''
     Command Line Interface to gather information regarding the container
@@ -129,6 +152,30 @@ class GromacsCLI(CLI):
 
         self.parser.add_argument('--regtest', action='store_true', help='ENABLE REGRESSION testing.')
 
+        self.parser.add_argument('--regtest-allow-failures', action='store_true',
+                                 help=('With --regtest, do not fail the image build when the regression tests '
+                                       'of an engine fail. The outcome is still recorded in the reports.'))
+
+        self.parser.add_argument('--instrument-build', action='store_true',
+                                 help=('ENABLE timestamp markers around every build step. The timings are '
+                                       'collected into {0} in the final image.'.format(config.BUILD_TIMINGS_FILE)))
+
+        self.parser.add_argument('--link', type=str,
+                                 default=config.DEFAULT_LINK,
+                                 choices=config.LINK_OPTIONS,
+                                 help=('How GROMACS engines are linked. static builds self-contained gmx binaries '
+                                       'with static GROMACS and FFTW libraries, not available with --fftw-container (DEFAULT: {0}).'.format(config.DEFAULT_LINK)))
+
+        self.parser.add_argument('--lto', action='store_true',
+                                 help='ENABLE link time optimization for GROMACS engines.')
+
+        self.parser.add_argument('--allocator', type=str,
+                                 default=config.DEFAULT_ALLOCATOR,
+                                 choices=config.ALLOCATORS,
+                                 help=('Memory allocator preloaded for the GROMACS engines. It can be disabled '
+                                       'per invocation with {0}=glibc (DEFAULT: {1}).'.format(config.ALLOCATOR_VARIABLE,
+                                                                                            config.DEFAULT_ALLOCATOR)))
+
         self.parser.add_argument('--cmake', type=str, default=config.DEFAULT_CMAKE_VERSION,
                                  help='CMAKE version (DEFAULT: {0}).'.format(config.DEFAULT_CMAKE_VERSION))
 
@@ -154,13 +201,15 @@ class GromacsCLI(CLI):
         '''
         Using this option user can specify SIMD instruction set from [sse2, avx, avx, avx_512f].
         For each SIMD instruction set, user can also specify whether to turn on RDTSCP ON or OFF
+        and optionally the precision of the engine (single or double)
         '''
         self.parser.add_argument('--engines', type=str,
-                                 metavar='simd={simd}:rdtscp={rdtscp}'.format(simd='|'.join(config.ENGINE_OPTIONS['simd']),
-                                                                              rdtscp='|'.join(config.ENGINE_OPTIONS['rdtscp'])),
+                                 metavar='simd={simd}:rdtscp={rdtscp}[:precision={precision}]'.format(simd='|'.join(config.ENGINE_OPTIONS['simd']),
+                                                                                                  rdtscp='|'.join(config.ENGINE_OPTIONS['rdtscp']),
+                                                                                                  precision='|'.join(config.ENGINE_OPTIONS['precision'])),
                                  nargs='+',
                                  default=[self.__get_default_gromacs_engine()],
-                                 help='SIMD for multiple GROMACS engines within same image container. List of Available choices: {choices} \n(DEFAULT: {default} ["Based on scripts HOST"]).'.format(
+                                 help='SIMD for multiple GROMACS engines within same image container. List of Available choices: {choices} \n(DEFAULT: {default} ["Based on scripts HOST"]). Engines without precision follow --double.'.format(
                                      choices=['simd=sse2:rdtscp=off', 'simd=sse2:rdtscp=on', 'simd=avx:rdtscp=off', 'simd=avx:rdtscp=on',
                                               'simd=avx2:rdtscp=off', 'simd=avx2:rdtscp=on', 'simd=avx_512f:rdtscp=off', 'simd=avx_512f:rdtscp=on'],
                                      default=self.__get_default_gromacs_engine())